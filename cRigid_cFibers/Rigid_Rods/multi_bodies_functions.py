@@ -6,7 +6,6 @@ bodies or the slip on the blobs.
 '''
 import numpy as np
 import sys
-import imp
 import os.path
 from functools import partial
 import scipy.spatial as spatial
@@ -11,6 +11,13 @@ except:
     import cpickle
   except:
     import _pickle as cpickle
+# Check if numba is installed
+try:
+  import numba
+  found_numba = True
+except ImportError:
+  print('numba not found, moves are proposed with numpy')
+  found_numba = False
 
 # Find project functions
 found_functions = False
@@ -32,6 +39,10 @@ while found_functions is False:
       print('\nProjected functions not found. Edit path in many_body_MCMC.py')
       sys.exit()
 
+# If numba is installed import mcmc_numba
+if found_numba:
+  import mcmc_numba
+
 # Override many_body_potential_pycuda.py with user defined functions.
 # If potential_pycuda_user_defined.py does not exists nothing happens.
 potential_pycuda_user_defined = False
@@ -42,17 +53,132 @@ if potential_pycuda_user_defined:
   sys.modules['many_body_potential_pycuda'] = __import__('potential_pycuda_user_defined')
   import many_body_potential_pycuda
 
-def get_blobs_r_vectors(bodies, Nblobs):
+def create_bodies(read, blob_radius):
+  '''
+  Create the rigid bodies of the structures in the input file as arrays.
+  Return the number of bodies of each structure, the locations (Nbodies, 3),
+  the orientations as quaternions (Nbodies, 4), the reference configurations
+  of all the blobs (Nblobs, 3), the blob offsets (Nbodies + 1) so that the
+  blobs of body n are blob_offsets[n]:blob_offsets[n+1], the mask of free
+  bodies (Nbodies) and the maximum length of the bodies.
+  The structures after the first read.num_free_bodies are obstacles.
+  '''
+  body_types = []
+  locations = []
+  orientations = []
+  reference_configurations = []
+  blobs_per_body = []
+  free_bodies = []
+  max_body_length = 0.0
+  for ID, structure in enumerate(read.structures):
+    print('Creating structures = ', structure[1])
+    struct_ref_config = read_vertex_file.read_vertex_file(structure[0])
+    num_bodies_struct, struct_locations, struct_orientations = read_clones_file.read_clones_file(structure[1])
+    body_types.append(num_bodies_struct)
+    # All the bodies of a structure share the reference configuration and length,
+    # use one body to compute them
+    b = body.Body(np.zeros(3), Quaternion([1.0, 0.0, 0.0, 0.0]), struct_ref_config, blob_radius)
+    max_body_length = max(max_body_length, b.calc_body_length())
+    locations.append(np.reshape(struct_locations, (num_bodies_struct, 3)))
+    orientations.append(np.reshape([q.entries for q in struct_orientations], (num_bodies_struct, 4)))
+    reference_configurations.append(np.tile(b.reference_configuration, (num_bodies_struct, 1)))
+    blobs_per_body.append(np.full(num_bodies_struct, b.Nblobs))
+    free_bodies.append(np.full(num_bodies_struct, ID < read.num_free_bodies))
+  blobs_per_body = np.concatenate(blobs_per_body)
+  blob_offsets = np.zeros(blobs_per_body.size + 1, dtype=int)
+  blob_offsets[1:] = np.cumsum(blobs_per_body)
+  return (body_types,
+          np.concatenate(locations).astype(np.float64),
+          np.concatenate(orientations).astype(np.float64),
+          np.concatenate(reference_configurations),
+          blob_offsets,
+          np.concatenate(free_bodies),
+          max_body_length)
+
+
+def rotation_matrices(orientations):
+  '''
+  Return the rotation matrices, with shape (Nbodies, 3, 3), of the
+  quaternions orientations (Nbodies, 4), see Quaternion.rotation_matrix.
+  '''
+  s = orientations[:, 0]
+  p = orientations[:, 1:]
+  R = 2.0 * (p[:, :, None] * p[:, None, :] + (s**2 - 0.5)[:, None, None] * np.eye(3))
+  R[:, 0, 1] -= 2.0 * s * p[:, 2]
+  R[:, 0, 2] += 2.0 * s * p[:, 1]
+  R[:, 1, 0] += 2.0 * s * p[:, 2]
+  R[:, 1, 2] -= 2.0 * s * p[:, 0]
+  R[:, 2, 0] -= 2.0 * s * p[:, 1]
+  R[:, 2, 1] += 2.0 * s * p[:, 0]
+  return R
+
+
+def get_blobs_r_vectors(locations, orientations, reference_configurations, blob_offsets):
   '''
   Return coordinates of all the blobs with shape (Nblobs, 3).
   '''
-  r_vectors = np.empty((Nblobs, 3))
-  offset = 0
-  for b in bodies:
-    num_blobs = b.Nblobs
-    r_vectors[offset:(offset+num_blobs)] = b.get_r_vectors()
-    offset += num_blobs
-  return r_vectors
+  body_of_blob = np.repeat(np.arange(locations.shape[0]), np.diff(blob_offsets))
+  R = rotation_matrices(orientations)
+  return np.einsum('nij,nj->ni', R[body_of_blob], reference_configurations) + locations[body_of_blob]
+
+
+def propose_move_numpy(locations, orientations, reference_configurations, blob_offsets, free_bodies, translations, rotations, locations_new, orientations_new, r_vectors):
+  '''
+  Disturb the location and orientation of the free bodies and
+  compute the blobs coordinates of the new configuration.
+  Same as mcmc_numba.propose_move_numba but vectorized with numpy,
+  it is used if numba is not available.
+  '''
+  num_bodies = locations.shape[0]
+  
+  # Quaternion shift from rotation vector, prescribed bodies are not disturbed
+  phi = np.where(free_bodies[:, None], rotations, 0.0)
+  phi_norm = np.linalg.norm(phi, axis=1)
+  s_shift = np.cos(phi_norm / 2.0)
+  p_shift = (np.sin(phi_norm / 2.0) / np.where(phi_norm > 0, phi_norm, 1.0))[:, None] * phi
+
+  # New orientation = quaternion_shift * orientation
+  s = orientations[:, 0]
+  p = orientations[:, 1:]
+  orientations_new[:, 0] = s_shift * s - np.sum(p_shift * p, axis=1)
+  orientations_new[:, 1:] = s_shift[:, None] * p + s[:, None] * p_shift + np.cross(p_shift, p)
+  locations_new[:] = locations + np.where(free_bodies[:, None], translations, 0.0)
+
+  # Blobs coordinates
+  R = rotation_matrices(orientations_new)
+  body_of_blob = np.repeat(np.arange(num_bodies), np.diff(blob_offsets))
+  r_vectors[:] = np.einsum('nij,nj->ni', R[body_of_blob], reference_configurations) + locations_new[body_of_blob]
+  return
+
+
+def create_random_generator(seed=None, random_state=None):
+  '''
+  Create a numpy random Generator. If random_state is given the
+  state is loaded from that pickle file, it can be the state of a
+  Generator or a legacy np.random state (which is loaded into
+  a MT19937 generator). Otherwise the generator (PCG64) is seeded
+  with seed or, if seed is None, with fresh entropy.
+  '''
+  if random_state is not None:
+    with open(random_state, 'rb') as f:
+      state = cpickle.load(f)
+    if isinstance(state, dict):
+      bit_generator = getattr(np.random, state['bit_generator'])()
+    else:
+      bit_generator = np.random.MT19937()
+      state = {'bit_generator': 'MT19937', 'state': {'key': state[1], 'pos': state[2]}}
+    bit_generator.state = state
+    return np.random.Generator(bit_generator)
+  return np.random.default_rng(None if seed is None else int(seed))
+
+
+def save_configuration(f, locations, orientations):
+  '''
+  Write the number of bodies and their locations and
+  orientations to the open file f, one body per line.
+  '''
+  f.write(str(locations.shape[0]) + '\n')
+  np.savetxt(f, np.hstack((locations, orientations)), fmt='%.17g')
 
 
 def set_blob_potential(implementation):
@@ -86,16 +212,12 @@ if __name__ == '__main__':
   # Copy input file to output
   subprocess.call(["cp", input_file, read.output_name + '.inputfile'])
 
-  # Set random generator state
-  if read.random_state is not None:
-    with open(read.random_state, 'rb') as f:
-      np.random.set_state(cpickle.load(f))
-  elif read.seed is not None:
-    np.random.seed(int(read.seed))
+  # Create random generator
+  rng = create_random_generator(seed=read.seed, random_state=read.random_state)
   
   # Save random generator state
   with open(read.output_name + '.random_state', 'wb') as f:
-    cpickle.dump(np.random.get_state(), f)
+    cpickle.dump(rng.bit_generator.state, f)
 
   # Parameters from the input file
   blob_radius = read.blob_radius
@@ -104,51 +226,61 @@ if __name__ == '__main__':
   weight = 1.0 * read.g
   kT = read.kT
 
-  # Create rigid bodies
-  bodies = []
-  body_types = []
-  max_body_length = 0.0
-  for ID, structure in enumerate(read.structures):
-    print('Creating structures = ', structure[1])
-    struct_ref_config = read_vertex_file.read_vertex_file(structure[0])
-    num_bodies_struct, struct_locations, struct_orientations = read_clones_file.read_clones_file(structure[1])
-    body_types.append(num_bodies_struct)
-    # Creat each body of type structure
-    for i in range(num_bodies_struct):
-      b = body.Body(struct_locations[i], struct_orientations[i], struct_ref_config, blob_radius)
-      b.ID = read.structures_ID[ID]
-      body_length = b.calc_body_length()
-      max_body_length = (body_length if body_length > max_body_length else max_body_length)
-      if ID >= read.num_free_bodies:
-        b.prescribed_kinematics = True
-      bodies.append(b)
-  bodies = np.array(bodies)
+  # Create rigid bodies, stored as arrays of locations, orientations and reference configurations
+  body_types, locations, orientations, reference_configurations, blob_offsets, free_bodies, max_body_length = create_bodies(read, blob_radius)
 
   # Set some more variables
-  num_bodies = bodies.size
-  Nblobs = sum([x.Nblobs for x in bodies])
+  num_bodies = locations.shape[0]
+  Nblobs = blob_offsets[-1]
   max_angle_shift = max_translation / max_body_length
   accepted_moves = 0
   acceptance_ratio = 0.5
 
   # Create blobs coordinates array
-  sample_r_vectors = get_blobs_r_vectors(bodies, Nblobs)
+  sample_r_vectors = get_blobs_r_vectors(locations, orientations, reference_configurations, blob_offsets)
+  locations_new = np.copy(locations)
+  orientations_new = np.copy(orientations)
+  # Obstacles are created after the free bodies, so only the
+  # first number_of_free_blobs blobs move during the simulation
+  num_free_bodies = np.count_nonzero(free_bodies)
+  number_of_free_blobs = blob_offsets[num_free_bodies]
+  if read.mcmc_move != 'all_bodies' and read.mcmc_move != 'single_body':
+    print('Error, mcmc_move =', read.mcmc_move, 'is not implemented.')
+    print('Use \"all_bodies\" or \"single_body\". \n')
+    sys.exit()
+
+  # Create object to compute the blobs energy, it keeps the blobs coordinates on the GPU
+  blob_energy = many_body_potential_pycuda.BlobEnergy(Nblobs,
+                                                      periodic_length = periodic_length,
+                                                      debye_length_wall = read.debye_length_wall,
+                                                      repulsion_strength_wall = read.repulsion_strength_wall,
+                                                      debye_length = read.debye_length,
+                                                      repulsion_strength = read.repulsion_strength,
+                                                      weight = weight,
+                                                      blob_radius = blob_radius,
+                                                      precision = read.mcmc_precision,
+                                                      cutoff = None if read.mcmc_cutoff == 'None' else float(read.mcmc_cutoff),
+                                                      cell_list = (read.mcmc_cell_list == 'True'),
+                                                      cell_skin = None if read.mcmc_cell_skin == 'None' else float(read.mcmc_cell_skin),
+                                                      specialize = (read.mcmc_specialize == 'True'),
+                                                      cuda_graph = (read.mcmc_cuda_graph == 'True'))
+  blob_energy.update_slice(0, sample_r_vectors)
+
+  # Use numba to propose moves if it is available
+  propose_move = mcmc_numba.propose_move_numba if found_numba else propose_move_numpy
+
+  # Open output files, they are kept open during the simulation
+  if read.save_clones == 'one_file':
+    output_files = []
+    for i, ID in enumerate(read.structures_ID):
+      name = read.output_name + '.' + ID + '.config'
+      output_files.append(open(name, 'w' if read.initial_step <= 0 else 'a'))
 
   # begin MCMC
   # get energy of the current state before jumping into the loop
   start_time = time.time()
-  current_state_energy = many_body_potential_pycuda.compute_total_energy(bodies,
-                                                                         sample_r_vectors,
-                                                                         periodic_length = periodic_length,
-                                                                         debye_length_wall = read.debye_length_wall,
-                                                                         repulsion_strength_wall = read.repulsion_strength_wall,
-                                                                         debye_length = read.debye_length,
-                                                                         repulsion_strength = read.repulsion_strength,
-                                                                         weight = weight,
-                                                                         blob_radius = blob_radius)
-
-  # quaternion to be used for disturbing the orientation of each body
-  quaternion_shift = Quaternion(np.array([1,0,0,0]))
+  current_bodies_energy = many_body_potential_pycuda.bodies_potential(locations, orientations, periodic_length = periodic_length)
+  current_state_energy = blob_energy.compute_energy() + current_bodies_energy
 
   # for each step in the Markov chain, disturb each body's location and orientation and obtain the new list of r_vectors
   # of each blob. Calculate the potential of the new state, and accept or reject it according to the Markov chain rules:
@@ -156,38 +288,71 @@ if __name__ == '__main__':
   # exp(-(Ej-Ei)/kT). Then record data.
   # Important: record data also when staying in the same state (i.e. when a sample state is rejected)
   for step in range(read.initial_step, read.n_steps):
-    blob_index = 0
-    for i, body in enumerate(bodies): # distrub bodies
-      if body.prescribed_kinematics is False:
-        body.location_new = body.location + np.random.uniform(-max_translation, max_translation, 3) # make small change to location
-        quaternion_shift = Quaternion.from_rotation(np.random.normal(0,1,3) * max_angle_shift)
-        body.orientation_new = quaternion_shift * body.orientation
-      else:
-        body.location_new = body.location
-        body.orientation_new = body.orientation
-      sample_r_vectors[blob_index : blob_index + bodies[i].Nblobs] = body.get_r_vectors(body.location_new, body.orientation_new)
-      blob_index += body.Nblobs
-
-    # calculate potential of proposed new state
-    sample_state_energy = many_body_potential_pycuda.compute_total_energy(bodies,
-                                                                          sample_r_vectors,
-                                                                          periodic_length = periodic_length,
-                                                                          debye_length_wall = read.debye_length_wall,
-                                                                          repulsion_strength_wall = read.repulsion_strength_wall,
-                                                                          debye_length = read.debye_length,
-                                                                          repulsion_strength = read.repulsion_strength,
-                                                                          weight = weight,
-                                                                          blob_radius = blob_radius)
+    if read.mcmc_move == 'single_body':
+      # distrub one free body chosen at random and compute its new blobs coordinates
+      n = rng.integers(num_free_bodies)
+      blob_lo, blob_hi = blob_offsets[n], blob_offsets[n+1]
+      translations = rng.uniform(-max_translation, max_translation, (1, 3))
+      rotations = rng.normal(0, 1, (1, 3)) * max_angle_shift
+      r_vectors_old = np.copy(sample_r_vectors[blob_lo : blob_hi])
+      propose_move(locations[n : n+1],
+                   orientations[n : n+1],
+                   reference_configurations[blob_lo : blob_hi],
+                   blob_offsets[n : n+2] - blob_lo,
+                   free_bodies[n : n+1],
+                   translations,
+                   rotations,
+                   locations_new[n : n+1],
+                   orientations_new[n : n+1],
+                   sample_r_vectors[blob_lo : blob_hi])
+
+      # calculate potential of proposed new state, only the interactions of the moved blobs and body are computed
+      sample_bodies_energy = current_bodies_energy \
+                             + many_body_potential_pycuda.body_potential(locations_new, orientations_new, n, periodic_length = periodic_length) \
+                             - many_body_potential_pycuda.body_potential(locations, orientations, n, periodic_length = periodic_length)
+      sample_state_energy = current_state_energy + blob_energy.compute_delta_energy(blob_lo, sample_r_vectors[blob_lo : blob_hi]) \
+                            + sample_bodies_energy - current_bodies_energy
+    else:
+      # distrub bodies and compute new blobs coordinates
+      translations = rng.uniform(-max_translation, max_translation, (num_bodies, 3))
+      rotations = rng.normal(0, 1, (num_bodies, 3)) * max_angle_shift
+      propose_move(locations,
+                   orientations,
+                   reference_configurations,
+                   blob_offsets,
+                   free_bodies,
+                   translations,
+                   rotations,
+                   locations_new,
+                   orientations_new,
+                   sample_r_vectors)
+
+      # calculate potential of proposed new state, only the free blobs are copied to the GPU.
+      # The bodies energy is computed while the GPU computes the blobs energy.
+      blob_energy.update_slice_and_launch_energy(0, sample_r_vectors[0 : number_of_free_blobs])
+      sample_bodies_energy = many_body_potential_pycuda.bodies_potential(locations_new, orientations_new, periodic_length = periodic_length)
+      sample_state_energy = blob_energy.get_energy() + sample_bodies_energy
 
     # accept or reject the sample state and collect data accordingly
-    if np.random.uniform(0.0, 1.0) < np.exp(-(sample_state_energy - current_state_energy) / kT):
+    if rng.uniform(0.0, 1.0) < np.exp(-(sample_state_energy - current_state_energy) / kT):
       current_state_energy = sample_state_energy
+      current_bodies_energy = sample_bodies_energy
       accepted_moves += 1
       acceptance_ratio = acceptance_ratio * 0.95 + 0.05
-      for body in bodies:
-        body.location, body.orientation = body.location_new, body.orientation_new
+      if read.mcmc_move == 'single_body':
+        locations[n] = locations_new[n]
+        orientations[n] = orientations_new[n]
+      else:
+        locations, locations_new = locations_new, locations
+        orientations, orientations_new = orientations_new, orientations
     else:
       acceptance_ratio = acceptance_ratio * 0.95
+      if read.mcmc_move == 'single_body':
+        # restore the moved body, also on the GPU
+        locations_new[n] = locations[n]
+        orientations_new[n] = orientations[n]
+        sample_r_vectors[blob_lo : blob_hi] = r_vectors_old
+        blob_energy.update_slice(blob_lo, r_vectors_old)
 	
     # Scale max_translation 
     if step < 0 and step < read.initial_step // 2 and acceptance_ratio > 0.5:
@@ -207,36 +372,16 @@ if __name__ == '__main__':
         for i, ID in enumerate(read.structures_ID):
           name = read.output_name + '.' + ID + '.' + str(step).zfill(8) + '.clones'
           with open(name, 'w') as f_ID:
-            f_ID.write(str(body_types[i]) + '\n')
-            for j in range(body_types[i]):
-              orientation = bodies[body_offset + j].orientation.entries
-              f_ID.write('%s %s %s %s %s %s %s\n' % (bodies[body_offset + j].location[0], 
-                                                     bodies[body_offset + j].location[1], 
-                                                     bodies[body_offset + j].location[2], 
-                                                     orientation[0], 
-                                                     orientation[1], 
-                                                     orientation[2], 
-                                                     orientation[3]))
-            body_offset += body_types[i]
+            save_configuration(f_ID,
+                               locations[body_offset : body_offset + body_types[i]],
+                               orientations[body_offset : body_offset + body_types[i]])
+          body_offset += body_types[i]
       elif read.save_clones == 'one_file':
-        for i, ID in enumerate(read.structures_ID):
-          name = read.output_name + '.' + ID + '.config'
-          if step == 0:
-            status = 'w'
-          else:
-            status = 'a'
-          with open(name, status) as f_ID:
-            f_ID.write(str(body_types[i]) + '\n')
-            for j in range(body_types[i]):
-              orientation = bodies[body_offset + j].orientation.entries
-              f_ID.write('%s %s %s %s %s %s %s\n' % (bodies[body_offset + j].location[0], 
-                                                     bodies[body_offset + j].location[1], 
-                                                     bodies[body_offset + j].location[2], 
-                                                     orientation[0], 
-                                                     orientation[1], 
-                                                     orientation[2], 
-                                                     orientation[3]))
-            body_offset += body_types[i]
+        for i, f_ID in enumerate(output_files):
+          save_configuration(f_ID,
+                             locations[body_offset : body_offset + body_types[i]],
+                             orientations[body_offset : body_offset + body_types[i]])
+          body_offset += body_types[i]
       else:
         print('Error, save_clones =', read.save_clones, 'is not implemented.')
         print('Use \"one_file_per_step\" or \"one_file\". \n')
@@ -251,41 +396,24 @@ if __name__ == '__main__':
       for i, ID in enumerate(read.structures_ID):
         name = read.output_name + '.' + ID + '.' + str(step+1).zfill(8) + '.clones'
         with open(name, 'w') as f_ID:
-          f_ID.write(str(body_types[i]) + '\n')
-          for j in range(body_types[i]):
-            orientation = bodies[body_offset + j].orientation.entries
-            f_ID.write('%s %s %s %s %s %s %s\n' % (bodies[body_offset + j].location[0], 
-                                                   bodies[body_offset + j].location[1], 
-                                                   bodies[body_offset + j].location[2], 
-                                                   orientation[0], 
-                                                   orientation[1], 
-                                                   orientation[2], 
-                                                   orientation[3]))
-          body_offset += body_types[i]
-      
+          save_configuration(f_ID,
+                             locations[body_offset : body_offset + body_types[i]],
+                             orientations[body_offset : body_offset + body_types[i]])
+        body_offset += body_types[i]
     elif read.save_clones == 'one_file':
-      for i, ID in enumerate(read.structures_ID):
-        name = read.output_name + '.' + ID + '.config'
-        if step+1 == 0:
-          status = 'w'
-        else:
-          status = 'a'
-        with open(name, status) as f_ID:
-          f_ID.write(str(body_types[i]) + '\n')
-          for j in range(body_types[i]):
-            orientation = bodies[body_offset + j].orientation.entries
-            f_ID.write('%s %s %s %s %s %s %s\n' % (bodies[body_offset + j].location[0], 
-                                                   bodies[body_offset + j].location[1], 
-                                                   bodies[body_offset + j].location[2], 
-                                                   orientation[0], 
-                                                   orientation[1], 
-                                                   orientation[2], 
-                                                   orientation[3]))
-          body_offset += body_types[i]
+      for i, f_ID in enumerate(output_files):
+        save_configuration(f_ID,
+                           locations[body_offset : body_offset + body_types[i]],
+                           orientations[body_offset : body_offset + body_types[i]])
+        body_offset += body_types[i]
     else:
       print('Error, save_clones =', read.save_clones, 'is not implemented.')
       print('Use \"one_file_per_step\" or \"one_file\". \n')
 
+  # Close output files
+  if read.save_clones == 'one_file':
+    for f_ID in output_files:
+      f_ID.close()
 
 
   end_time = time.time() - start_time
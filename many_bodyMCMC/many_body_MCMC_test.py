@@ -0,0 +1,86 @@
+''' Test the proposal of moves of the MCMC codes. '''
+
+import unittest
+import numpy as np
+import sys
+from importlib.util import find_spec
+sys.path.append('..')
+
+from body import body
+from quaternion_integrator.quaternion import Quaternion
+
+# many_body_MCMC imports many_body_potential_pycuda, so it needs pycuda
+found_numba = find_spec('numba') is not None
+found_pycuda = find_spec('pycuda') is not None
+if found_numba:
+  import mcmc_numba
+if found_pycuda:
+  import many_body_MCMC
+
+
+class TestProposeMove(unittest.TestCase):
+
+  def setUp(self):
+    ''' Create bodies with different number of blobs, the third one is prescribed. '''
+    rng = np.random.default_rng(0)
+    num_blobs = [3, 4, 1, 6, 2]
+    self.bodies = []
+    for n, Nblobs in enumerate(num_blobs):
+      q = rng.normal(0., 1., 4)
+      b = body.Body(rng.random(3), Quaternion(q / np.linalg.norm(q)), rng.random((Nblobs, 3)), 0.5)
+      b.prescribed_kinematics = (n == 2)
+      self.bodies.append(b)
+    self.translations = rng.uniform(-0.1, 0.1, (len(num_blobs), 3))
+    self.rotations = rng.normal(0., 1., (len(num_blobs), 3))
+    # Include a zero rotation
+    self.rotations[3] = 0.
+
+  def propose_move_bodies(self):
+    ''' Original proposal of moves with the Body and Quaternion classes. '''
+    locations = []
+    orientations = []
+    r_vectors = []
+    for i, b in enumerate(self.bodies):
+      if b.prescribed_kinematics is False:
+        location_new = b.location + self.translations[i]
+        orientation_new = Quaternion.from_rotation(self.rotations[i]) * b.orientation
+      else:
+        location_new = b.location
+        orientation_new = b.orientation
+      locations.append(location_new)
+      orientations.append(orientation_new.entries)
+      r_vectors.append(b.get_r_vectors(location_new, orientation_new))
+    return np.array(locations), np.array(orientations), np.concatenate(r_vectors)
+
+  def check_propose_move(self, propose_move):
+    ''' Compare propose_move with the original proposal for the same increments. '''
+    locations = np.array([b.location for b in self.bodies])
+    orientations = np.array([b.orientation.entries for b in self.bodies])
+    reference_configurations = np.concatenate([b.reference_configuration for b in self.bodies])
+    blob_offsets = np.zeros(len(self.bodies) + 1, dtype=int)
+    blob_offsets[1:] = np.cumsum([b.Nblobs for b in self.bodies])
+    free_bodies = np.array([b.prescribed_kinematics is False for b in self.bodies])
+    locations_new = np.empty_like(locations)
+    orientations_new = np.empty_like(orientations)
+    r_vectors = np.empty((blob_offsets[-1], 3))
+    propose_move(locations, orientations, reference_configurations, blob_offsets, free_bodies,
+                 self.translations, self.rotations, locations_new, orientations_new, r_vectors)
+
+    locations_ref, orientations_ref, r_vectors_ref = self.propose_move_bodies()
+    self.assertAlmostEqual(np.max(np.abs(locations_new - locations_ref)), 0.0, places=12)
+    self.assertAlmostEqual(np.max(np.abs(orientations_new - orientations_ref)), 0.0, places=12)
+    self.assertAlmostEqual(np.max(np.abs(r_vectors - r_vectors_ref)), 0.0, places=12)
+
+  @unittest.skipIf(not found_numba, 'numba not found')
+  def test_propose_move_numba(self):
+    ''' Test propose_move_numba against the original proposal. '''
+    self.check_propose_move(mcmc_numba.propose_move_numba)
+
+  @unittest.skipIf(not found_pycuda, 'pycuda not found')
+  def test_propose_move_numpy(self):
+    ''' Test propose_move_numpy against the original proposal. '''
+    self.check_propose_move(many_body_MCMC.propose_move_numpy)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,222 @@
+'''
+Parallel tempering Markov Chain Monte Carlo for rigid bodies.
+
+The code runs mcmc_chains Markov chains with temperatures
+geometrically spaced between kT and mcmc_kT_max. The blobs energies
+of all the chains are computed in a single GPU launch. Every
+mcmc_swap_interval steps the configurations of chains with
+neighbor temperatures are swapped with probability
+
+min(1, exp((1/kT_k - 1/kT_{k+1}) * (U_k - U_{k+1}))).
+
+If mcmc_kT_max = kT the chains are independent and no swaps are attempted.
+The chain 0 (temperature kT) is saved as in many_body_MCMC.py,
+the chain k with the name output_name + '.chain' + k.
+
+How to use:
+python many_body_parallel_tempering.py input_file
+'''
+import numpy as np
+import time
+import sys
+import subprocess
+
+# Import functions from the MCMC code, including
+# the user defined potentials if they exist
+import many_body_MCMC as mcmc
+from many_body_MCMC import many_body_potential_pycuda
+from many_body_MCMC import create_bodies, get_blobs_r_vectors, propose_move_numpy, save_configuration, create_random_generator, cpickle
+from read_input import read_input
+
+
+def save_chains(step, output_names, output_files, structures_ID, body_types, locations, orientations, save_clones):
+  '''
+  Save the locations and orientations of all the chains. With
+  save_clones = one_file_per_step one file per chain, structure and step
+  is created, otherwise the configuration is appended to output_files[chain][structure].
+  '''
+  for k, output_name in enumerate(output_names):
+    body_offset = 0
+    for i, ID in enumerate(structures_ID):
+      if save_clones == 'one_file_per_step':
+        name = output_name + '.' + ID + '.' + str(step).zfill(8) + '.clones'
+        with open(name, 'w') as f_ID:
+          save_configuration(f_ID,
+                             locations[k, body_offset : body_offset + body_types[i]],
+                             orientations[k, body_offset : body_offset + body_types[i]])
+      else:
+        save_configuration(output_files[k][i],
+                           locations[k, body_offset : body_offset + body_types[i]],
+                           orientations[k, body_offset : body_offset + body_types[i]])
+      body_offset += body_types[i]
+  return
+
+
+if __name__ == '__main__':
+
+  # script takes input file as command line argument or default 'data.main'
+  if len(sys.argv) != 2:
+    input_file = 'data.main'
+  else:
+    input_file = sys.argv[1]
+
+  # Read input file
+  read = read_input.ReadInput(input_file)
+
+  # Copy input file to output
+  subprocess.call(["cp", input_file, read.output_name + '.inputfile'])
+
+  # Create random generator
+  rng = create_random_generator(seed=read.seed, random_state=read.random_state)
+
+  # Save random generator state
+  with open(read.output_name + '.random_state', 'wb') as f:
+    cpickle.dump(rng.bit_generator.state, f)
+
+  # Parameters from the input file
+  blob_radius = read.blob_radius
+  periodic_length = read.periodic_length
+  weight = 1.0 * read.g
+  kT = read.kT
+  num_chains = read.mcmc_chains
+  kT_chains = kT * (read.mcmc_kT_max / kT)**(np.arange(num_chains) / max(num_chains - 1, 1))
+  if read.save_clones != 'one_file_per_step' and read.save_clones != 'one_file':
+    print('Error, save_clones =', read.save_clones, 'is not implemented.')
+    print('Use \"one_file_per_step\" or \"one_file\". \n')
+    sys.exit()
+
+  # Create rigid bodies, stored as arrays of locations, orientations and reference configurations
+  body_types, body_locations, body_orientations, reference_configurations, blob_offsets, free_bodies, max_body_length = create_bodies(read, blob_radius)
+
+  # Set some more variables, the step sizes are adapted independently for each chain
+  num_bodies = body_locations.shape[0]
+  Nblobs = blob_offsets[-1]
+  max_translation = np.ones(num_chains) * blob_radius * 0.1
+  max_angle_shift = max_translation / max_body_length
+  accepted_moves = np.zeros(num_chains)
+  acceptance_ratio = np.ones(num_chains) * 0.5
+  swap_attempts = np.zeros(max(num_chains - 1, 1))
+  swap_accepted = np.zeros(max(num_chains - 1, 1))
+
+  # Store locations, orientations and blobs coordinates of all the chains as arrays,
+  # all the chains start from the same configuration
+  locations = np.array([body_locations] * num_chains)
+  orientations = np.array([body_orientations] * num_chains)
+  sample_r_vectors = np.array([get_blobs_r_vectors(body_locations, body_orientations, reference_configurations, blob_offsets)] * num_chains)
+  locations_new = np.copy(locations)
+  orientations_new = np.copy(orientations)
+  # Obstacles are created after the free bodies, so only the
+  # first number_of_free_blobs blobs move during the simulation
+  number_of_free_blobs = blob_offsets[np.count_nonzero(free_bodies)]
+
+  # Create object to compute the blobs energy of all the chains
+  blob_energy = many_body_potential_pycuda.BlobEnergy(Nblobs,
+                                                      periodic_length = periodic_length,
+                                                      debye_length_wall = read.debye_length_wall,
+                                                      repulsion_strength_wall = read.repulsion_strength_wall,
+                                                      debye_length = read.debye_length,
+                                                      repulsion_strength = read.repulsion_strength,
+                                                      weight = weight,
+                                                      blob_radius = blob_radius,
+                                                      precision = read.mcmc_precision,
+                                                      cutoff = None if read.mcmc_cutoff == 'None' else float(read.mcmc_cutoff),
+                                                      specialize = (read.mcmc_specialize == 'True'),
+                                                      number_of_chains = num_chains)
+  for k in range(num_chains):
+    blob_energy.update_slice(0, sample_r_vectors[k], chain=k)
+
+  # Use numba to propose moves if it is available
+  propose_move = mcmc.mcmc_numba.propose_move_numba if mcmc.found_numba else propose_move_numpy
+
+  # Open output files, they are kept open during the simulation
+  output_names = [read.output_name] + [read.output_name + '.chain' + str(k) for k in range(1, num_chains)]
+  output_files = []
+  if read.save_clones == 'one_file':
+    for output_name in output_names:
+      output_files.append([open(output_name + '.' + ID + '.config', 'w' if read.initial_step <= 0 else 'a') for ID in read.structures_ID])
+
+  # begin MCMC
+  # get energy of the current states before jumping into the loop
+  start_time = time.time()
+  current_bodies_energy = np.array([many_body_potential_pycuda.bodies_potential(locations[k], orientations[k], periodic_length = periodic_length)
+                                    for k in range(num_chains)])
+  current_state_energy = blob_energy.compute_energies() + current_bodies_energy
+
+  for step in range(read.initial_step, read.n_steps):
+    # distrub bodies of all the chains and compute new blobs coordinates
+    translations = rng.uniform(-1.0, 1.0, (num_chains, num_bodies, 3)) * max_translation[:, None, None]
+    rotations = rng.normal(0, 1, (num_chains, num_bodies, 3)) * max_angle_shift[:, None, None]
+    for k in range(num_chains):
+      propose_move(locations[k],
+                   orientations[k],
+                   reference_configurations,
+                   blob_offsets,
+                   free_bodies,
+                   translations[k],
+                   rotations[k],
+                   locations_new[k],
+                   orientations_new[k],
+                   sample_r_vectors[k])
+      blob_energy.update_slice(0, sample_r_vectors[k, 0 : number_of_free_blobs], chain=k)
+
+    # calculate potential of proposed new states, the blobs energies of all the chains are computed in one launch
+    # while the bodies energies are computed
+    blob_energy.launch_energy()
+    sample_bodies_energy = np.array([many_body_potential_pycuda.bodies_potential(locations_new[k], orientations_new[k], periodic_length = periodic_length)
+                                     for k in range(num_chains)])
+    sample_state_energy = blob_energy.get_energies() + sample_bodies_energy
+
+    # accept or reject the sample state of each chain
+    accept = rng.uniform(0.0, 1.0, num_chains) < np.exp(-(sample_state_energy - current_state_energy) / kT_chains)
+    current_state_energy[accept] = sample_state_energy[accept]
+    current_bodies_energy[accept] = sample_bodies_energy[accept]
+    locations[accept] = locations_new[accept]
+    orientations[accept] = orientations_new[accept]
+    accepted_moves += accept
+    acceptance_ratio = acceptance_ratio * 0.95 + 0.05 * accept
+
+    # Scale max_translation
+    if step < 0 and step < read.initial_step // 2:
+      max_translation = np.where(acceptance_ratio > 0.5, max_translation * 1.02, max_translation * 0.98)
+      max_angle_shift = max_translation / max_body_length
+
+    # Swap configurations of neighbor temperatures, alternating even and odd pairs
+    if num_chains > 1 and read.mcmc_kT_max != kT and (step % read.mcmc_swap_interval) == 0:
+      for k in range((step // read.mcmc_swap_interval) % 2, num_chains - 1, 2):
+        swap_attempts[k] += 1
+        if rng.uniform(0.0, 1.0) < np.exp((1.0 / kT_chains[k] - 1.0 / kT_chains[k+1]) * (current_state_energy[k] - current_state_energy[k+1])):
+          swap_accepted[k] += 1
+          for x in (locations, orientations, current_state_energy, current_bodies_energy):
+            x[[k, k+1]] = x[[k+1, k]]
+
+    # Save data if...
+    if (step % read.n_save) == 0 and step >= 0:
+      print('Parallel tempering, step = ', step, ', wallclock time = ', time.time() - start_time, ', acceptance ratios = ', accepted_moves / (step+1.0-read.initial_step))
+      save_chains(step, output_names, output_files, read.structures_ID, body_types, locations, orientations, read.save_clones)
+
+  # Save final data if...
+  if ((step+1) % read.n_save) == 0 and step >= 0:
+    print('Parallel tempering, step = ', step+1, ', wallclock time = ', time.time() - start_time, ', acceptance ratios = ', accepted_moves / (step+2.0-read.initial_step))
+    save_chains(step+1, output_names, output_files, read.structures_ID, body_types, locations, orientations, read.save_clones)
+
+  # Close output files
+  for files in output_files:
+    for f_ID in files:
+      f_ID.close()
+
+  end_time = time.time() - start_time
+  print('\nacceptance ratios = ', accepted_moves / (step+2.0-read.initial_step))
+  print('swap acceptance ratios = ', swap_accepted / np.maximum(swap_attempts, 1))
+  print('Total time = ', end_time)
+
+  # Save wallclock time
+  with open(read.output_name + '.time', 'w') as f:
+    f.write(str(time.time() - start_time) + '\n')
+  # Save acceptance ratios
+  with open(read.output_name + '.MCMC_info', 'w') as f:
+    f.write('kT = ' + str(kT_chains) + '\n')
+    f.write('acceptance ratio = ' + str(accepted_moves / (step+2.0-read.initial_step)) + '\n')
+    f.write('accepted_moves = ' +  str(accepted_moves) + '\n')
+    f.write('swap acceptance ratio = ' + str(swap_accepted / np.maximum(swap_attempts, 1)) + '\n')
+    f.write('final max_translation = ' +  str(max_translation) + '\n')
+    f.write('final max_angle_shift = ' +  str(max_angle_shift) + '\n')
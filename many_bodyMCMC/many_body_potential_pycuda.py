@@ -3,32 +3,61 @@ import numpy as np
 import pycuda.driver as cuda
 import pycuda.autoinit
 from pycuda.compiler import SourceModule
+from pycuda.tools import DeviceData, OccupancyRecord
 
 
-mod = SourceModule("""
+kernels_header = """
 #include <stdio.h>
 
+/*
+  The blob potentials are computed with the type real, double
+  by default or float if SINGLE_PRECISION is defined. Coordinates
+  and the final sums are always stored in double precision.
+*/
+#ifdef SINGLE_PRECISION
+typedef float real;
+#else
+typedef double real;
+#endif
+
+/*
+  The parameters of the blobs kernels are passed as arguments
+  (name_arg) or, if CONSTANT_PARAMETERS is defined, as the compile
+  time constants name_CONSTANT (see get_source_module). With
+  constants the compiler can fold them and remove branches.
+*/
+#ifdef CONSTANT_PARAMETERS
+#define PARAMETER(type, name) const type name = name##_CONSTANT
+#else
+#define PARAMETER(type, name) const type name = name##_arg
+#endif
+"""
+
+# Device functions with the blobs and bodies potentials. A user module can
+# override them by assigning new strings with the same functions
+# (see examples/boomerang_suspension/potential_pycuda_user_defined.py).
+blob_potentials_source = """
 /*
   Cumpute the enery coming from one blob potentials,
   e.g. gravity or interactions with the wall.
 */
-__device__ void one_blob_potential(double &u, 
-                                   const double rx, 
-                                   const double ry, 
-                                   const double rz, 
-                                   const double blob_radius, 
-                                   const double debye_length_wall, 
-                                   const double eps_wall, 
-                                   const double weight){
+__device__ void one_blob_potential(real &u, 
+                                   const real rx, 
+                                   const real ry, 
+                                   const real rz, 
+                                   const real blob_radius, 
+                                   const real inv_debye_length_wall, 
+                                   const real eps_wall, 
+                                   const real weight){
   // Add gravity
   u += weight * rz;
 
   // Add interaction with the wall
   if (rz < blob_radius){
-    u += eps_wall + eps_wall * (blob_radius - rz) / debye_length_wall;
+    u += eps_wall + eps_wall * (blob_radius - rz) * inv_debye_length_wall;
   }
   else{
-    u += eps_wall * exp(-(rz - blob_radius) / debye_length_wall);
+    u += eps_wall * exp(-(rz - blob_radius) * inv_debye_length_wall);
   }
   return;
 }
@@ -36,88 +65,29 @@ __device__ void one_blob_potential(double &u,
 /*
   Compute the energy coming from blob-blob potentials.
 */
-__device__ void blob_blob_potential(double &u,
-                                    const double rx,
-                                    const double ry,
-                                    const double rz,
+__device__ void blob_blob_potential(real &u,
+                                    const real rx,
+                                    const real ry,
+                                    const real rz,
                                     const int i,
                                     const int j,
-                                    const double debye_length,
-                                    const double eps,
-                                    const double blob_radius){                
+                                    const real inv_debye_length,
+                                    const real eps,
+                                    const real blob_radius){                
   if(i != j){
-    double r = sqrt(rx*rx + ry*ry + rz*rz);
-    if(r < 2.0*blob_radius){
-      u += eps + eps * (2.0*blob_radius - r) / debye_length;
+    real r = sqrt(rx*rx + ry*ry + rz*rz);
+    if(r < 2*blob_radius){
+      u += eps + eps * (2*blob_radius - r) * inv_debye_length;
     }
     else{
-      u += eps * exp(-(r - 2.0*blob_radius) / debye_length);
-    }
-  }
-  return;
-}
-
-/*
-  Compute blobs energy. It takes into account both
-  single blob and two blobs contributions.
-*/
-__global__ void potential_from_position_blobs(const double *x,
-                                              double *total_U, 
-                                              const int n_blobs,
-                                              const double Lx,
-                                              const double Ly,
-                                              const double debye_length_wall,
-                                              const double eps_wall,
-                                              const double debye_length,
-                                              const double eps,
-                                              const double weight,
-                                              const double blob_radius){
-
-  
-  int i = blockDim.x * blockIdx.x + threadIdx.x;
-  if(i >= n_blobs) return;   
-
-  double u = 0.0;
-  double rx, ry, rz;
-  int NDIM = 3; // 3 is the spatial dimension
-  int ioffset = i * NDIM; 
-  int joffset;
-  
-  if (x[ioffset+2] > 0){
-    // 1. One blob potential
-    one_blob_potential(u, x[ioffset], x[ioffset+1], x[ioffset+2], blob_radius, debye_length_wall, eps_wall, weight);
-
-    // 2. Two blobs potential
-    // IMPORTANT, we don't want to compute the blob-blob interaction twice! 
-    // See the loop limits.
-    for(int j=i+1; j<n_blobs; j++){
-      joffset = j * NDIM;
-      // Compute vector between particles i and j    
-      rx = x[ioffset    ] - x[joffset    ];
-      ry = x[ioffset + 1] - x[joffset + 1];
-      rz = x[ioffset + 2] - x[joffset + 2];
-      if (Lx > 0){
-        rx = rx - int(rx / Lx + 0.5 * (int(rx>0) - int(rx<0))) * Lx;
-      }
-      if (Ly > 0){
-        ry = ry - int(ry / Ly + 0.5 * (int(ry>0) - int(ry<0))) * Ly;
-      }
-      // Compute blob-blob interaction
-      blob_blob_potential(u, rx, ry, rz, i, j, debye_length, eps, blob_radius);
+      u += eps * exp(-(r - 2*blob_radius) * inv_debye_length);
     }
   }
-  else
-  {
-    // make u large for blobs behind the wall
-    // if a particle starts out of bounds somehow, then it won't want to move further out
-    u = 1e+05*(-x[ioffset+2] +1); 
-  }
-  //IF END
-  //3. Save potential U_i
-  total_U[i] = u;
   return;
 }
+"""
 
+body_potentials_source = """
 /*
   Compute one body potentials.
   Default is zero.
@@ -153,11 +123,434 @@ __device__ void body_body_potential(double &u,
   
   return;
 }
+"""
+
+kernels_source = """
+/*
+  Atomic addition for doubles. The native atomicAdd for doubles
+  is only available for compute capability >= 6.0.
+*/
+__device__ double atomic_add_double(double *address, const double val){
+#if __CUDA_ARCH__ >= 600
+  return atomicAdd(address, val);
+#else
+  unsigned long long int *address_as_ull = (unsigned long long int *) address;
+  unsigned long long int old = *address_as_ull, assumed;
+  do{
+    assumed = old;
+    old = atomicCAS(address_as_ull, assumed, __double_as_longlong(val + __longlong_as_double(assumed)));
+  } while(assumed != old);
+  return __longlong_as_double(old);
+#endif
+}
+
+/*
+  Sum u over the threads of the block and add the result to total_U.
+  First each warp reduces its values with shuffles, then the first
+  warp reduces the partial sums of all the warps.
+  All the threads of the block must call this function.
+*/
+__device__ void block_reduce_add(double u, double *total_U){
+  __shared__ double u_warps[32];
+  int lane = threadIdx.x % warpSize;
+  int warp = threadIdx.x / warpSize;
+
+  for(int offset=warpSize/2; offset>0; offset/=2){
+    u += __shfl_down_sync(0xffffffff, u, offset);
+  }
+  if(lane == 0){
+    u_warps[warp] = u;
+  }
+  __syncthreads();
+
+  if(warp == 0){
+    int num_warps = (blockDim.x + warpSize - 1) / warpSize;
+    u = (lane < num_warps) ? u_warps[lane] : 0.0;
+    for(int offset=warpSize/2; offset>0; offset/=2){
+      u += __shfl_down_sync(0xffffffff, u, offset);
+    }
+    if(lane == 0){
+      atomic_add_double(total_U, u);
+    }
+  }
+  return;
+}
+
+/*
+  Compute blobs energy. It takes into account both
+  single blob and two blobs contributions.
+
+  The blobs coordinates are stored as structure of arrays
+  (x, y, z) and they are loaded in tiles of blockDim.x blobs
+  into shared memory, therefore the kernel has to be launched
+  with 3 * blockDim.x * sizeof(double) bytes of dynamic shared memory.
+  Pairs with distance larger than sqrt(rcut2) are neglected.
+  The energy of all the blobs is added to total_U[0], which
+  has to be set to zero before the launch.
+
+  Several independent configurations (e.g. Markov chains) can
+  be computed in one launch with gridDim.y > 1. The blobs of 
+  configuration blockIdx.y are stored in x[blockIdx.y * n_blobs], ...
+  and its energy is added to total_U[blockIdx.y].
+*/
+__global__ void potential_from_position_blobs(const double *x,
+                                              const double *y,
+                                              const double *z,
+                                              double *total_U, 
+                                              const int n_blobs_arg,
+                                              const double Lx_arg,
+                                              const double Ly_arg,
+                                              const double debye_length_wall_arg,
+                                              const double eps_wall_arg,
+                                              const double debye_length_arg,
+                                              const double eps_arg,
+                                              const double weight_arg,
+                                              const double blob_radius_arg,
+                                              const double rcut2_arg){
+
+  // Parameters of the potentials
+  PARAMETER(int, n_blobs);
+  PARAMETER(double, Lx);
+  PARAMETER(double, Ly);
+  PARAMETER(double, debye_length_wall);
+  PARAMETER(double, eps_wall);
+  PARAMETER(double, debye_length);
+  PARAMETER(double, eps);
+  PARAMETER(double, weight);
+  PARAMETER(double, blob_radius);
+  PARAMETER(double, rcut2);
+
+  // Inverse Debye lengths, the potentials multiply by them
+  const real inv_debye_length = 1.0 / debye_length;
+  const real inv_debye_length_wall = 1.0 / debye_length_wall;
+
+  extern __shared__ double x_tile[];
+  int i = blockDim.x * blockIdx.x + threadIdx.x;
+  int tile_dim = blockDim.x;
+
+  // Select configuration
+  x += blockIdx.y * n_blobs;
+  y += blockIdx.y * n_blobs;
+  z += blockIdx.y * n_blobs;
+  total_U += blockIdx.y;
+
+  real u = 0;
+  real u_pairs = 0;
+  double rx, ry, rz;
+  double xi = 0.0, yi = 0.0, zi = 0.0;
+  if(i < n_blobs){
+    xi = x[i];
+    yi = y[i];
+    zi = z[i];
+  }
+  // Only blobs above the wall interact with other blobs.
+  // Threads without blob (i >= n_blobs) still load tiles.
+  bool active = (i < n_blobs) && (zi > 0);
+  // Inverse periodic lengths, zero for non periodic directions
+  double inv_Lx = (Lx > 0) ? (1.0 / Lx) : 0.0;
+  double inv_Ly = (Ly > 0) ? (1.0 / Ly) : 0.0;
+
+  // 2. Two blobs potential
+  // Loop over tiles of blobs, each pair is visited twice (j != i).
+  for(int tile_offset=0; tile_offset<n_blobs; tile_offset+=tile_dim){
+    // Load one blob per thread into shared memory
+    int j = tile_offset + threadIdx.x;
+    if(j < n_blobs){
+      x_tile[threadIdx.x               ] = x[j];
+      x_tile[threadIdx.x +     tile_dim] = y[j];
+      x_tile[threadIdx.x + 2 * tile_dim] = z[j];
+    }
+    __syncthreads();
+
+    if(active){
+      int tile_size = n_blobs - tile_offset;
+      if(tile_size > tile_dim){
+        tile_size = tile_dim;
+      }
+      for(int k=0; k<tile_size; k++){
+        // Compute vector between particles i and j    
+        rx = xi - x_tile[k               ];
+        ry = yi - x_tile[k +     tile_dim];
+        rz = zi - x_tile[k + 2 * tile_dim];
+        // Minimum image convention, no-op if inv_Lx = 0 or inv_Ly = 0
+        rx -= Lx * rint(rx * inv_Lx);
+        ry -= Ly * rint(ry * inv_Ly);
+        // Skip pairs beyond the cutoff
+        if(rx*rx + ry*ry + rz*rz > rcut2){
+          continue;
+        }
+        // Compute blob-blob interaction
+        blob_blob_potential(u_pairs, rx, ry, rz, i, tile_offset + k, inv_debye_length, eps, blob_radius);
+      }
+    }
+    __syncthreads();
+  }
+
+  if (active){
+    // 1. One blob potential
+    one_blob_potential(u, xi, yi, zi, blob_radius, inv_debye_length_wall, eps_wall, weight);
+
+    // Pairs were visited twice, see loop above. Each blob above the wall
+    // adds half of its pairs energy, so the weight of the pair i-j is
+    // 0.5 * (active_i + active_j), as in potential_from_position_blobs_partial.
+    u += 0.5 * u_pairs;
+  }
+  else if (i < n_blobs)
+  {
+    // make u large for blobs behind the wall
+    // if a particle starts out of bounds somehow, then it won't want to move further out
+    u = 1e+05*(-zi +1); 
+  }
+  //IF END
+  //3. Add potential U_i to the total energy
+  block_reduce_add(u, total_U);
+  return;
+}
+
+/*
+  Compute the energy of the interactions involving the blobs
+  moved_lo:moved_hi, i.e. the blobs of the body that was moved.
+  Each thread handles one blob j of the system and adds its interactions
+  with the moved blobs i; threads of moved blobs also add the one blob
+  terms. The pairs (i,j) are weighted as in potential_from_position_blobs,
+  so the difference of two calls with the moved blobs before and after
+  a move gives the change of the total blobs energy.
+  The result is added to total_U[0], which has to be set to zero
+  before the launch.
+*/
+__global__ void potential_from_position_blobs_partial(const double *x,
+                                                      const double *y,
+                                                      const double *z,
+                                                      double *total_U, 
+                                                      const int n_blobs_arg,
+                                                      const int moved_lo,
+                                                      const int moved_hi,
+                                                      const double Lx_arg,
+                                                      const double Ly_arg,
+                                                      const double debye_length_wall_arg,
+                                                      const double eps_wall_arg,
+                                                      const double debye_length_arg,
+                                                      const double eps_arg,
+                                                      const double weight_arg,
+                                                      const double blob_radius_arg,
+                                                      const double rcut2_arg){
+
+  // Parameters of the potentials
+  PARAMETER(int, n_blobs);
+  PARAMETER(double, Lx);
+  PARAMETER(double, Ly);
+  PARAMETER(double, debye_length_wall);
+  PARAMETER(double, eps_wall);
+  PARAMETER(double, debye_length);
+  PARAMETER(double, eps);
+  PARAMETER(double, weight);
+  PARAMETER(double, blob_radius);
+  PARAMETER(double, rcut2);
+
+  // Inverse Debye lengths, the potentials multiply by them
+  const real inv_debye_length = 1.0 / debye_length;
+  const real inv_debye_length_wall = 1.0 / debye_length_wall;
+
+  int j = blockDim.x * blockIdx.x + threadIdx.x;
+
+  real u = 0;
+  if(j < n_blobs){
+    double rx, ry, rz;
+    double xj = x[j];
+    double yj = y[j];
+    double zj = z[j];
+    bool active_j = (zj > 0);
+    bool moved_j = (j >= moved_lo) && (j < moved_hi);
+    // Inverse periodic lengths, zero for non periodic directions
+    double inv_Lx = (Lx > 0) ? (1.0 / Lx) : 0.0;
+    double inv_Ly = (Ly > 0) ? (1.0 / Ly) : 0.0;
+
+    // 2. Two blobs potential
+    // Pairs with one blob above the wall get half weight, pairs
+    // with both blobs above the wall full weight. Pairs inside
+    // the moved body are visited twice.
+    for(int i=moved_lo; i<moved_hi; i++){
+      double zi = z[i];
+      bool active_i = (zi > 0);
+      if(!(active_i || active_j)){
+        continue;
+      }
+      rx = x[i] - xj;
+      ry = y[i] - yj;
+      rz = zi - zj;
+      // Minimum image convention, no-op if inv_Lx = 0 or inv_Ly = 0
+      rx -= Lx * rint(rx * inv_Lx);
+      ry -= Ly * rint(ry * inv_Ly);
+      // Skip pairs beyond the cutoff
+      if(rx*rx + ry*ry + rz*rz > rcut2){
+        continue;
+      }
+      real u_pair = 0;
+      blob_blob_potential(u_pair, rx, ry, rz, i, j, inv_debye_length, eps, blob_radius);
+      double w = 0.5 * (int(active_i) + int(active_j));
+      if(moved_j){
+        w *= 0.5;
+      }
+      u += w * u_pair;
+    }
+
+    // 1. One blob potential
+    if(moved_j){
+      if(active_j){
+        one_blob_potential(u, xj, yj, zj, blob_radius, inv_debye_length_wall, eps_wall, weight);
+      }
+      else{
+        // make u large for blobs behind the wall
+        u += 1e+05*(-zj +1); 
+      }
+    }
+  }
+  //3. Add potential U_j to the total energy
+  block_reduce_add(u, total_U);
+  return;
+}
+
+/*
+  Compute blobs energy using a cell list. It gives the same
+  result as potential_from_position_blobs, but each blob only
+  visits the blobs of its 27 neighbor cells.
+
+  blob_cell[i] is the cell of blob i, with cells numbered
+  as cx + ncx * (cy + ncy * cz). The blobs of cell c are
+  cell_blobs[cell_start[c]:cell_end[c]]. The cells are larger than
+  the cutoff; along a periodic direction there are either one or
+  at least three cells.
+  The energy of all the blobs is added to total_U[0], which
+  has to be set to zero before the launch.
+*/
+__global__ void potential_from_position_blobs_cells(const double *x,
+                                                    const double *y,
+                                                    const double *z,
+                                                    double *total_U, 
+                                                    const int *blob_cell,
+                                                    const int *cell_blobs,
+                                                    const int *cell_start,
+                                                    const int *cell_end,
+                                                    const int ncx,
+                                                    const int ncy,
+                                                    const int ncz,
+                                                    const int n_blobs_arg,
+                                                    const double Lx_arg,
+                                                    const double Ly_arg,
+                                                    const double debye_length_wall_arg,
+                                                    const double eps_wall_arg,
+                                                    const double debye_length_arg,
+                                                    const double eps_arg,
+                                                    const double weight_arg,
+                                                    const double blob_radius_arg,
+                                                    const double rcut2_arg){
+
+  // Parameters of the potentials
+  PARAMETER(int, n_blobs);
+  PARAMETER(double, Lx);
+  PARAMETER(double, Ly);
+  PARAMETER(double, debye_length_wall);
+  PARAMETER(double, eps_wall);
+  PARAMETER(double, debye_length);
+  PARAMETER(double, eps);
+  PARAMETER(double, weight);
+  PARAMETER(double, blob_radius);
+  PARAMETER(double, rcut2);
+
+  // Inverse Debye lengths, the potentials multiply by them
+  const real inv_debye_length = 1.0 / debye_length;
+  const real inv_debye_length_wall = 1.0 / debye_length_wall;
+
+  int i = blockDim.x * blockIdx.x + threadIdx.x;
 
+  real u = 0;
+  real u_pairs = 0;
+  if(i < n_blobs){
+    double rx, ry, rz;
+    double xi = x[i];
+    double yi = y[i];
+    double zi = z[i];
+    // Only blobs above the wall interact with other blobs.
+    if(zi > 0){
+      // Inverse periodic lengths, zero for non periodic directions
+      double inv_Lx = (Lx > 0) ? (1.0 / Lx) : 0.0;
+      double inv_Ly = (Ly > 0) ? (1.0 / Ly) : 0.0;
+      int ci = blob_cell[i];
+      int cx = ci % ncx;
+      int cy = (ci / ncx) % ncy;
+      int cz = ci / (ncx * ncy);
+      int dx_max = (ncx > 1) ? 1 : 0;
+      int dy_max = (ncy > 1) ? 1 : 0;
+      int dz_max = (ncz > 1) ? 1 : 0;
+
+      // 2. Two blobs potential
+      // Loop over neighbor cells, each pair is visited twice (j != i).
+      for(int dz=-dz_max; dz<=dz_max; dz++){
+        int nz = cz + dz;
+        if(nz < 0 || nz >= ncz){
+          continue;
+        }
+        for(int dy=-dy_max; dy<=dy_max; dy++){
+          int ny = cy + dy;
+          if(Ly > 0){
+            ny = (ny + ncy) % ncy;
+          }
+          else if(ny < 0 || ny >= ncy){
+            continue;
+          }
+          for(int dx=-dx_max; dx<=dx_max; dx++){
+            int nx = cx + dx;
+            if(Lx > 0){
+              nx = (nx + ncx) % ncx;
+            }
+            else if(nx < 0 || nx >= ncx){
+              continue;
+            }
+            int c = nx + ncx * (ny + ncy * nz);
+            for(int k=cell_start[c]; k<cell_end[c]; k++){
+              int j = cell_blobs[k];
+              // Compute vector between particles i and j    
+              rx = xi - x[j];
+              ry = yi - y[j];
+              rz = zi - z[j];
+              // Minimum image convention, no-op if inv_Lx = 0 or inv_Ly = 0
+              rx -= Lx * rint(rx * inv_Lx);
+              ry -= Ly * rint(ry * inv_Ly);
+              // Skip pairs beyond the cutoff
+              if(rx*rx + ry*ry + rz*rz > rcut2){
+                continue;
+              }
+              // Compute blob-blob interaction
+              blob_blob_potential(u_pairs, rx, ry, rz, i, j, inv_debye_length, eps, blob_radius);
+            }
+          }
+        }
+      }
+
+      // 1. One blob potential
+      one_blob_potential(u, xi, yi, zi, blob_radius, inv_debye_length_wall, eps_wall, weight);
+
+      // Pairs were visited twice, see loop above. The weight of
+      // the pair i-j is 0.5 * (active_i + active_j), see potential_from_position_blobs.
+      u += 0.5 * u_pairs;
+    }
+    else
+    {
+      // make u large for blobs behind the wall
+      // if a particle starts out of bounds somehow, then it won't want to move further out
+      u = 1e+05*(-zi +1); 
+    }
+  }
+  //3. Add potential U_i to the total energy
+  block_reduce_add(u, total_U);
+  return;
+}
 
 /*
   Compute bodies energy. It takes into account both
   single body and two bodies contributions.
+  The energy of all the bodies is added to total_U[0], which
+  has to be set to zero before the launch.
 */
 __global__ void potential_from_position_bodies(const double *x,
                                                const double *q,
@@ -168,7 +561,6 @@ __global__ void potential_from_position_bodies(const double *x,
 
   
   int i = blockDim.x * blockIdx.x + threadIdx.x;
-  if(i >= n_bodies) return;   
 
   double u = 0.0;
   double rx, ry, rz;
@@ -176,7 +568,11 @@ __global__ void potential_from_position_bodies(const double *x,
   int ioffset = i * NDIM; 
   int joffset;
   
-  {
+  // Inverse periodic lengths, zero for non periodic directions
+  double inv_Lx = (Lx > 0) ? (1.0 / Lx) : 0.0;
+  double inv_Ly = (Ly > 0) ? (1.0 / Ly) : 0.0;
+
+  if(i < n_bodies){
     // 1. One body potential
     one_body_potential(u, x[ioffset], x[ioffset+1], x[ioffset+2],
                        q[i*4], q[i*4+1], q[i*4+2], q[i*4+3]);
@@ -190,12 +586,9 @@ __global__ void potential_from_position_bodies(const double *x,
       rx = x[ioffset    ] - x[joffset    ];
       ry = x[ioffset + 1] - x[joffset + 1];
       rz = x[ioffset + 2] - x[joffset + 2];
-      if (Lx > 0){
-        rx = rx - int(rx / Lx + 0.5 * (int(rx>0) - int(rx<0))) * Lx;
-      }
-      if (Ly > 0){
-        ry = ry - int(ry / Ly + 0.5 * (int(ry>0) - int(ry<0))) * Ly;
-      }
+      // Minimum image convention, no-op if inv_Lx = 0 or inv_Ly = 0
+      rx -= Lx * rint(rx * inv_Lx);
+      ry -= Ly * rint(ry * inv_Ly);
       // Compute blob-blob interaction
       body_body_potential(u, rx, ry, rz, 
                           q[i*4], q[i*4+1], q[i*4+2], q[i*4+3],
@@ -205,18 +598,115 @@ __global__ void potential_from_position_bodies(const double *x,
   }
 
   //IF END
-  //3. Save potential U_i
-  total_U[i] = u;
+  //3. Add potential U_i to the total energy
+  block_reduce_add(u, total_U);
+  return;
+}
+
+/*
+  Compute the energy of the body n, i.e. its one body potential
+  and its interactions with the other bodies. The thread i computes
+  the interaction between the bodies n and i, with the same order
+  of the pair as in potential_from_position_bodies.
+  The energy is added to total_U[0], which has to be set to zero
+  before the launch.
+*/
+__global__ void potential_from_position_bodies_partial(const double *x,
+                                                       const double *q,
+                                                       double *total_U, 
+                                                       const int n_bodies,
+                                                       const int n,
+                                                       const double Lx,
+                                                       const double Ly){
+  int i = blockDim.x * blockIdx.x + threadIdx.x;
+
+  double u = 0.0;
+  int NDIM = 3; // 3 is the spatial dimension
+
+  // Inverse periodic lengths, zero for non periodic directions
+  double inv_Lx = (Lx > 0) ? (1.0 / Lx) : 0.0;
+  double inv_Ly = (Ly > 0) ? (1.0 / Ly) : 0.0;
+
+  if(i < n_bodies){
+    if(i == n){
+      // 1. One body potential
+      one_body_potential(u, x[n*NDIM], x[n*NDIM+1], x[n*NDIM+2],
+                         q[n*4], q[n*4+1], q[n*4+2], q[n*4+3]);
+    }
+    else{
+      // 2. Body-body potential, the pair is ordered as (lo, hi) with lo < hi
+      int lo = (i < n) ? i : n;
+      int hi = (i < n) ? n : i;
+      double rx = x[lo*NDIM    ] - x[hi*NDIM    ];
+      double ry = x[lo*NDIM + 1] - x[hi*NDIM + 1];
+      double rz = x[lo*NDIM + 2] - x[hi*NDIM + 2];
+      // Minimum image convention, no-op if inv_Lx = 0 or inv_Ly = 0
+      rx -= Lx * rint(rx * inv_Lx);
+      ry -= Ly * rint(ry * inv_Ly);
+      body_body_potential(u, rx, ry, rz, 
+                          q[lo*4], q[lo*4+1], q[lo*4+2], q[lo*4+3],
+                          q[hi*4], q[hi*4+1], q[hi*4+2], q[hi*4+3],
+                          lo, hi);
+    }
+  }
+
+  // 3. Add potential U_i to the total energy
+  block_reduce_add(u, total_U);
   return;
 }
-""")
+"""
+
+# Kernels compiled for each precision, set of constants and potentials,
+# compiled the first time they are used
+modules = {}
+
+
+def get_source_module(precision='double', constants=None):
+  '''
+  Return the module with the kernels compiled in double or single
+  precision. The single precision kernels use fast math, they are
+  faster on most GPUs but the blobs energy has a relative error ~1e-06.
 
+  constants is an optional dictionary with the parameters of the blobs
+  kernels (see the macro PARAMETER). They are compiled as constants and
+  the kernels ignore the corresponding arguments. A module is
+  compiled for each set of constants.
 
-def set_number_of_threads_and_blocks(num_elements):
+  The kernels use the potentials in blob_potentials_source and
+  body_potentials_source at the time of the call.
+  '''
+  if precision not in ('double', 'single'):
+    raise Exception('precision must be double or single.')
+  defines = ''
+  if precision == 'single':
+    defines += '#define SINGLE_PRECISION\n'
+  if constants is not None:
+    defines += '#define CONSTANT_PARAMETERS\n'
+    for name, value in sorted(constants.items()):
+      defines += '#define %s_CONSTANT %.17g\n' % (name, value)
+  source = defines + kernels_header + blob_potentials_source + body_potentials_source + kernels_source
+  if source not in modules:
+    options = ['-use_fast_math'] if precision == 'single' else None
+    modules[source] = SourceModule(source, options=options)
+  return modules[source]
+
+
+def blob_blob_cutoff(debye_length, blob_radius):
+  '''
+  Return the distance beyond which the blob-blob interactions
+  are neglected when the cell list is used without a cutoff.
+  At this distance the potential has decayed by a factor exp(-10).
+  '''
+  return 2.0 * blob_radius + 10.0 * debye_length
+
+
+def set_number_of_threads_and_blocks(num_elements, kernel=None, shared_bytes_per_thread=0):
   '''
   This functions uses a heuristic method to determine
   the number of blocks and threads per block to be
-  used in CUDA kernels.
+  used in CUDA kernels. If the kernel is given the number
+  of threads per block is limited by the occupancy of the
+  multiprocessors, see occupancy_threads_per_block.
   '''
   threads_per_block=512
   if((num_elements//threads_per_block) < 512):
@@ -225,116 +715,601 @@ def set_number_of_threads_and_blocks(num_elements):
     threads_per_block = 128
   if((num_elements//threads_per_block) < 128):
     threads_per_block = 64
-  if((num_elements//threads_per_block) < 128):
+  if((num_elements//threads_per_block) < 64):
     threads_per_block = 32
+  if kernel is not None:
+    threads_per_block = occupancy_threads_per_block(kernel, threads_per_block, shared_bytes_per_thread)
   num_blocks = (num_elements-1)//threads_per_block + 1
   return (threads_per_block, int(num_blocks))
 
 
+# Device data and block sizes computed by occupancy_threads_per_block,
+# the block size only depends on the kernel resources and the device
+device_data = None
+occupancy_threads = {}
+
+
+def occupancy_threads_per_block(kernel, max_threads_per_block, shared_bytes_per_thread=0):
+  '''
+  Return the number of threads per block, a multiple of the warp size
+  and at most max_threads_per_block, that gives the highest occupancy
+  of the multiprocessors given the registers used by the kernel and
+  its dynamic shared memory. Among blocks with the same occupancy
+  the largest one is used.
+
+  The result is stored in occupancy_threads, so the occupancy
+  is only computed once for each kernel and block limits.
+  '''
+  global device_data
+  registers = kernel.get_attribute(cuda.function_attribute.NUM_REGS)
+  max_threads_per_block = min(max_threads_per_block, kernel.get_attribute(cuda.function_attribute.MAX_THREADS_PER_BLOCK))
+  key = (registers, max_threads_per_block, shared_bytes_per_thread)
+  if key in occupancy_threads:
+    return occupancy_threads[key]
+  if device_data is None:
+    device_data = DeviceData()
+  best_threads, best_occupancy = device_data.warp_size, 0
+  threads = device_data.warp_size
+  while threads <= max_threads_per_block:
+    try:
+      occupancy = OccupancyRecord(device_data, threads, shared_mem=threads * shared_bytes_per_thread, registers=registers).occupancy
+    except ValueError:
+      # The kernel can not be launched with this block
+      break
+    if occupancy >= best_occupancy:
+      best_threads, best_occupancy = threads, occupancy
+    threads *= 2
+  occupancy_threads[key] = best_threads
+  return best_threads
+
+
+class BlobEnergy(object):
+  '''
+  Class to compute the energy of the blobs. The blobs coordinates
+  and the energy buffer are kept on the GPU between calls, so only
+  the blobs that moved have to be copied to the GPU.
+  '''
+  def __init__(self, number_of_blobs, *args, **kwargs):
+    '''
+    Constructor. Allocate the GPU memory for number_of_blobs blobs
+    and store the parameters of the potential. Use the keyword
+    precision='single' to compute the potentials in single precision
+    and cell_list=True to compute the energy with a cell list.
+    With specialize=True the number of blobs and the parameters
+    of the potential are compiled as constants in the kernels.
+
+    Use cutoff to neglect the blob-blob interactions beyond that
+    distance. By default there is no cutoff, except with the cell
+    list, which uses the distance given by blob_blob_cutoff.
+    The cells are larger than the cutoff plus cell_skin (default 0.2
+    times the cutoff) and the cell list is only rebuilt when a blob has
+    moved more than cell_skin / 2 since the last build.
+
+    With cuda_graph=True update_slice_and_launch_energy replays a
+    CUDA graph with the copies and the kernel launch. This option has
+    not been tested on a GPU yet.
+
+    Use number_of_chains > 1 to store several configurations of
+    the blobs (e.g. independent Markov chains) and compute their 
+    energies in one launch with compute_energies. 
+    '''
+    # Store options, the number of threads and blocks is set with the kernels
+    self.number_of_blobs = np.int32(number_of_blobs)
+    self.number_of_chains = kwargs.get('number_of_chains') or 1
+    self.precision = kwargs.get('precision') or 'double'
+    self.specialize = kwargs.get('specialize') or False
+    self.cell_list = kwargs.get('cell_list') or False
+    self.cutoff = kwargs.get('cutoff')
+    self.cell_skin = kwargs.get('cell_skin')
+    self.cuda_graph = kwargs.get('cuda_graph') or False
+    self.module = None
+
+    # Get parameters from arguments
+    self.set_parameters(*args, **kwargs)
+
+    # Allocate pinned CPU memory, coordinates as structure of arrays (x, y, z).
+    # The kernel reduces the energy to a single double.
+    self.x = cuda.pagelocked_zeros((3, self.number_of_chains * self.number_of_blobs), np.float64)
+    self.U = cuda.pagelocked_empty(self.number_of_chains, np.float64)
+
+    # Allocate GPU memory
+    self.x_gpu = cuda.mem_alloc(self.x[0].nbytes)
+    self.y_gpu = cuda.mem_alloc(self.x[1].nbytes)
+    self.z_gpu = cuda.mem_alloc(self.x[2].nbytes)
+    self.u_gpu = cuda.mem_alloc(self.U.nbytes)
+    self.stream = cuda.Stream()
+
+    # Allocate GPU memory for the cell list, the cells arrays are allocated when they are built
+    if self.cell_list and self.number_of_chains > 1:
+      raise Exception('The cell list can only be used with one chain.')
+    if self.cell_list:
+      self.blob_cell_gpu = cuda.mem_alloc(self.x[0].size * 4)
+      self.cell_blobs_gpu = cuda.mem_alloc(self.x[0].size * 4)
+      self.cell_start_gpu = None
+      self.cell_end_gpu = None
+      self.cells_capacity = 0
+
+
+  def get_kernels(self):
+    '''
+    Get the kernels from the compiled module. If self.specialize is
+    True the module is compiled for the current parameters.
+    Nothing is done if the module has not changed.
+    '''
+    constants = None
+    if self.specialize:
+      constants = {'n_blobs': self.number_of_blobs,
+                   'Lx': self.Lx,
+                   'Ly': self.Ly,
+                   'debye_length_wall': self.debye_length_wall,
+                   'eps_wall': self.eps_wall,
+                   'debye_length': self.debye_length,
+                   'eps': self.eps,
+                   'weight': self.weight,
+                   'blob_radius': self.blob_radius,
+                   'rcut2': self.rcut2}
+    module = get_source_module(self.precision, constants)
+    if module is self.module:
+      return
+    self.module = module
+    self.potential_from_position_blobs = module.get_function("potential_from_position_blobs")
+    self.potential_from_position_blobs_partial = module.get_function("potential_from_position_blobs_partial")
+    self.potential_from_position_blobs_cells = module.get_function("potential_from_position_blobs_cells")
+
+    # Prepare the kernels with their arguments types (P pointer, i int, d double),
+    # the launches with prepared_async_call skip the arguments inspection
+    self.potential_from_position_blobs.prepare('PPPPiddddddddd')
+    self.potential_from_position_blobs_partial.prepare('PPPPiiiddddddddd')
+    self.potential_from_position_blobs_cells.prepare('PPPPPPPPiiiiddddddddd')
+
+    # Determine number of threads and blocks for the GPU, the tiled kernel
+    # uses 3 doubles of dynamic shared memory per thread
+    if self.cell_list:
+      self.threads_per_block, self.num_blocks = set_number_of_threads_and_blocks(self.number_of_blobs,
+                                                                                 self.potential_from_position_blobs_cells)
+    else:
+      self.threads_per_block, self.num_blocks = set_number_of_threads_and_blocks(self.number_of_blobs,
+                                                                                 self.potential_from_position_blobs,
+                                                                                 3 * np.dtype(np.float64).itemsize)
+
+
+  def set_parameters(self, *args, **kwargs):
+    '''
+    Set the parameters of the potential.
+    '''
+    periodic_length = kwargs.get('periodic_length')
+    self.Lx = np.float64(periodic_length[0])
+    self.Ly = np.float64(periodic_length[1])
+    self.debye_length_wall = np.float64(kwargs.get('debye_length_wall'))
+    self.eps_wall = np.float64(kwargs.get('repulsion_strength_wall'))
+    self.debye_length = np.float64(kwargs.get('debye_length'))
+    self.eps = np.float64(kwargs.get('repulsion_strength'))
+    self.weight = np.float64(kwargs.get('weight'))
+    self.blob_radius = np.float64(kwargs.get('blob_radius'))
+
+    # Squared cutoff, the largest double means no cutoff
+    cutoff = self.cutoff
+    if cutoff is None and self.cell_list:
+      cutoff = blob_blob_cutoff(self.debye_length, self.blob_radius)
+    if cutoff is None:
+      self.rcut2 = np.float64(np.finfo(np.float64).max)
+    else:
+      self.rcut2 = np.float64(cutoff)**2
+    self.skin = 0.2 * np.sqrt(self.rcut2) if self.cell_skin is None else self.cell_skin
+
+    # The cell list depends on the cutoff, it has to be built again
+    self.x_cells = None
+
+    # The CUDA graph stores the parameters, it has to be captured again
+    self.graph_exec = None
+    self.graph_slice = None
+
+    # The kernels only depend on the parameters if they are compiled as constants
+    if self.specialize or self.module is None:
+      self.get_kernels()
+
+
+  def update_slice(self, offset, r_vectors, chain=0):
+    '''
+    Copy the coordinates of the blobs offset:offset+len(r_vectors)
+    of the configuration chain to the GPU (host to device). 
+    The copy is asynchronous and uses the pinned buffer self.x.
+    '''
+    number_of_blobs = r_vectors.size // 3
+    offset += chain * self.number_of_blobs
+    self.x[:, offset : offset + number_of_blobs] = np.reshape(r_vectors, (number_of_blobs, 3)).T
+    nbytes_offset = offset * self.x.itemsize
+    for k, x_gpu in enumerate([self.x_gpu, self.y_gpu, self.z_gpu]):
+      cuda.memcpy_htod_async(int(x_gpu) + nbytes_offset, self.x[k, offset : offset + number_of_blobs], self.stream)
+    
+
+  def cell_list_outdated(self):
+    '''
+    Return True if the cell list has not been built or if a blob has
+    moved more than self.skin / 2 since it was built. Otherwise two blobs
+    closer than the cutoff are still in neighbor cells.
+    '''
+    if self.x_cells is None:
+      return True
+    dr = self.x - self.x_cells
+    if self.Lx > 0:
+      dr[0] -= self.Lx * np.rint(dr[0] / self.Lx)
+    if self.Ly > 0:
+      dr[1] -= self.Ly * np.rint(dr[1] / self.Ly)
+    return np.max(np.einsum('ij,ij->j', dr, dr)) > 0.25 * self.skin**2
+
+
+  def build_cell_list(self):
+    '''
+    Build the cell list with the blobs coordinates of the host
+    buffer self.x and copy it to the GPU. The cells are at least as
+    large as the cutoff plus the skin. Along the non periodic directions the
+    cells cover the blobs and there are at most
+    max_cells_per_dimension cells. Along a periodic direction there are
+    either one or at least three cells.
+    '''
+    max_cells_per_dimension = 64
+    rcut = np.sqrt(self.rcut2) + self.skin
+    periodic_length = [self.Lx, self.Ly, 0]
+    num_cells = np.ones(3, dtype=np.int32)
+    cell = np.empty((3, self.number_of_blobs), dtype=np.int64)
+    for k in range(3):
+      if periodic_length[k] > 0:
+        L = periodic_length[k]
+        num_cells[k] = int(L / rcut) if L >= 3 * rcut else 1
+        r = self.x[k] - L * np.floor(self.x[k] / L)
+        cell_length = L / num_cells[k]
+      else:
+        r = self.x[k] - np.min(self.x[k])
+        extent = np.max(r)
+        cell_length = max(rcut, extent / max_cells_per_dimension)
+        num_cells[k] = int(extent / cell_length) + 1
+      cell[k] = np.clip((r / cell_length).astype(np.int64), 0, num_cells[k] - 1)
+
+    # Sort blobs by cell
+    blob_cell = (cell[0] + num_cells[0] * (cell[1] + num_cells[1] * cell[2])).astype(np.int32)
+    cell_blobs = np.argsort(blob_cell, kind='stable').astype(np.int32)
+    total_cells = int(np.prod(num_cells))
+    sorted_cells = blob_cell[cell_blobs]
+    cell_start = np.searchsorted(sorted_cells, np.arange(total_cells), side='left').astype(np.int32)
+    cell_end = np.searchsorted(sorted_cells, np.arange(total_cells), side='right').astype(np.int32)
+
+    # Copy cell list to the GPU
+    if total_cells > self.cells_capacity:
+      self.cells_capacity = total_cells
+      self.cell_start_gpu = cuda.mem_alloc(cell_start.nbytes)
+      self.cell_end_gpu = cuda.mem_alloc(cell_end.nbytes)
+    cuda.memcpy_htod(self.blob_cell_gpu, blob_cell)
+    cuda.memcpy_htod(self.cell_blobs_gpu, cell_blobs)
+    cuda.memcpy_htod(self.cell_start_gpu, cell_start)
+    cuda.memcpy_htod(self.cell_end_gpu, cell_end)
+    self.num_cells = num_cells
+    self.x_cells = np.copy(self.x)
+
+
+  def launch_energy(self):
+    '''
+    Launch the computation of the energy of the blobs stored on
+    the GPU and the copy of the energy to self.U. The work is
+    queued in self.stream, this function does not synchronize.
+    '''
+    # Set energy to zero, the kernel accumulates on it
+    cuda.memset_d8_async(self.u_gpu, 0, self.U.nbytes, self.stream)
+
+    if self.cell_list:
+      # Compute pair interactions with the cell list, rebuilt only if the blobs moved too much
+      if self.cell_list_outdated():
+        self.build_cell_list()
+      self.potential_from_position_blobs_cells.prepared_async_call((self.num_blocks, 1), (self.threads_per_block, 1, 1), self.stream,
+                                                                   self.x_gpu, self.y_gpu, self.z_gpu, self.u_gpu,
+                                                                   self.blob_cell_gpu,
+                                                                   self.cell_blobs_gpu,
+                                                                   self.cell_start_gpu,
+                                                                   self.cell_end_gpu,
+                                                                   self.num_cells[0],
+                                                                   self.num_cells[1],
+                                                                   self.num_cells[2],
+                                                                   self.number_of_blobs,
+                                                                   self.Lx,
+                                                                   self.Ly,
+                                                                   self.debye_length_wall,
+                                                                   self.eps_wall,
+                                                                   self.debye_length,
+                                                                   self.eps,
+                                                                   self.weight,
+                                                                   self.blob_radius,
+                                                                   self.rcut2)
+    else:
+      # Compute pair interactions
+      self.potential_from_position_blobs.prepared_async_call((self.num_blocks, self.number_of_chains), (self.threads_per_block, 1, 1), self.stream,
+                                                             self.x_gpu, self.y_gpu, self.z_gpu, self.u_gpu,
+                                                             self.number_of_blobs,
+                                                             self.Lx,
+                                                             self.Ly,
+                                                             self.debye_length_wall,
+                                                             self.eps_wall,
+                                                             self.debye_length,
+                                                             self.eps,
+                                                             self.weight,
+                                                             self.blob_radius,
+                                                             self.rcut2,
+                                                             shared_size=3 * self.threads_per_block * self.x.itemsize)
+    
+    # Copy data from GPU to CPU (device to host)
+    cuda.memcpy_dtoh_async(self.U, self.u_gpu, self.stream)
+
+
+  def get_energy(self):
+    '''
+    Wait for the work queued in self.stream and return the energy
+    computed by the last launch. With several chains it returns
+    the energy of the first one.
+    '''
+    self.stream.synchronize()
+    return self.U[0]
+
+
+  def get_energies(self):
+    '''
+    Wait for the work queued in self.stream and return the energies
+    of all the chains computed by the last launch, with shape (number_of_chains).
+    '''
+    self.stream.synchronize()
+    return np.copy(self.U)
+
+
+  def compute_energy(self):
+    '''
+    Compute the energy of the blobs stored on the GPU.
+    With several chains it returns the energy of the first one.
+    '''
+    self.launch_energy()
+    return self.get_energy()
+
+
+  def compute_energies(self):
+    '''
+    Compute the energy of the blobs of every chain,
+    return an array with shape (number_of_chains).
+    '''
+    self.launch_energy()
+    return self.get_energies()
+
+
+  def update_slice_and_launch_energy(self, offset, r_vectors):
+    '''
+    Copy the coordinates of the blobs offset:offset+len(r_vectors)
+    to the GPU and launch the computation of the energy of the blobs.
+    This function does not synchronize, get the energy with get_energy.
+
+    By default it calls update_slice and launch_energy. With
+    cuda_graph=True the copies and the kernel launch are captured in
+    a CUDA graph the first time the function is called with a given
+    slice, the following calls replay the graph with a single driver
+    call. The graph is not used if CUDA graphs are not available
+    (PyCUDA < 2022.1), the cell list is used or there are several chains.
+    '''
+    if not self.cuda_graph or self.cell_list or self.number_of_chains > 1 or not hasattr(self.stream, 'begin_capture'):
+      self.update_slice(offset, r_vectors)
+      self.launch_energy()
+      return
+
+    # The graph reads the coordinates from the pinned buffer
+    number_of_blobs = r_vectors.size // 3
+    self.x[:, offset : offset + number_of_blobs] = np.reshape(r_vectors, (number_of_blobs, 3)).T
+    if self.graph_slice != (offset, number_of_blobs):
+      self.stream.begin_capture()
+      self.update_slice(offset, r_vectors)
+      self.launch_energy()
+      self.graph_exec = self.stream.end_capture().instance()
+      self.graph_slice = (offset, number_of_blobs)
+    self.graph_exec.launch(self.stream)
+
+
+  def update_slice_and_compute_energy(self, offset, r_vectors):
+    '''
+    Copy the coordinates of the blobs offset:offset+len(r_vectors)
+    to the GPU and compute the energy of the blobs.
+    '''
+    self.update_slice_and_launch_energy(offset, r_vectors)
+    return self.get_energy()
+
+
+  def compute_partial_energy(self, moved_lo, moved_hi):
+    '''
+    Compute the energy of the interactions involving the
+    blobs moved_lo:moved_hi, with the coordinates stored on the GPU.
+    The cost is O(N * (moved_hi - moved_lo)).
+    '''
+    # Set energy to zero, the kernel accumulates on it
+    cuda.memset_d8_async(self.u_gpu, 0, self.U.nbytes, self.stream)
+
+    # Compute pair interactions
+    self.potential_from_position_blobs_partial.prepared_async_call((self.num_blocks, 1), (self.threads_per_block, 1, 1), self.stream,
+                                                                   self.x_gpu, self.y_gpu, self.z_gpu, self.u_gpu,
+                                                                   self.number_of_blobs,
+                                                                   np.int32(moved_lo),
+                                                                   np.int32(moved_hi),
+                                                                   self.Lx,
+                                                                   self.Ly,
+                                                                   self.debye_length_wall,
+                                                                   self.eps_wall,
+                                                                   self.debye_length,
+                                                                   self.eps,
+                                                                   self.weight,
+                                                                   self.blob_radius,
+                                                                   self.rcut2)
+    
+    # Copy data from GPU to CPU (device to host)
+    cuda.memcpy_dtoh_async(self.U, self.u_gpu, self.stream)
+    self.stream.synchronize()
+    return self.U[0]
+
+
+  def compute_delta_energy(self, offset, r_vectors_new):
+    '''
+    Move the blobs offset:offset+len(r_vectors_new) to r_vectors_new
+    and return the change in the blobs energy,
+
+    Delta U = U_partial(new) - U_partial(old).
+
+    The coordinates on the GPU are updated, to reject the move
+    copy back the old coordinates with update_slice.
+    '''
+    moved_hi = offset + r_vectors_new.size // 3
+    u_old = self.compute_partial_energy(offset, moved_hi)
+    self.update_slice(offset, r_vectors_new)
+    u_new = self.compute_partial_energy(offset, moved_hi)
+    return u_new - u_old
+
+
+# Bodies kernels, prepared with their arguments types (P pointer, i int, d double)
+bodies_kernels = {}
+
+
+def get_bodies_kernel(name='potential_from_position_bodies', arg_types='PPPidd'):
+  '''
+  Return the bodies kernel with the given name, it is prepared
+  the first time it is used.
+  '''
+  module = get_source_module()
+  if (module, name) not in bodies_kernels:
+    kernel = module.get_function(name)
+    kernel.prepare(arg_types)
+    bodies_kernels[(module, name)] = kernel
+  return bodies_kernels[(module, name)]
+
+# BlobEnergy object and GPU buffers reused between calls to
+# blobs_potential and bodies_potential. They are reallocated only
+# if the number of blobs or bodies changes.
+_blob_energy = None
+_blob_energy_kwargs = None
+_bodies_buffers = None
+
+
+def same_kwargs(kwargs, kwargs_old):
+  '''
+  Return True if the keyword arguments kwargs are equal to kwargs_old.
+  The values can be numbers, strings or arrays.
+  '''
+  if kwargs_old is None or kwargs.keys() != kwargs_old.keys():
+    return False
+  return all(np.array_equal(kwargs[key], kwargs_old[key]) for key in kwargs)
+
+
 def blobs_potential(r_vectors, *args, **kwargs):
   '''
   This function compute the energy of the blobs.
+  The parameters are only updated if kwargs changed since the last call.
+  '''
+  global _blob_energy, _blob_energy_kwargs
+  number_of_blobs = r_vectors.size // 3
+  if _blob_energy is None or _blob_energy.number_of_blobs != number_of_blobs:
+    _blob_energy = BlobEnergy(number_of_blobs, *args, **kwargs)
+    _blob_energy_kwargs = None
+  elif not same_kwargs(kwargs, _blob_energy_kwargs):
+    _blob_energy.set_parameters(*args, **kwargs)
+    _blob_energy_kwargs = None
+  if _blob_energy_kwargs is None:
+    # Store a copy of the parameters, the caller may modify its arrays in place
+    _blob_energy_kwargs = {key: np.copy(value) for key, value in kwargs.items()}
+  _blob_energy.update_slice(0, r_vectors)
+  return _blob_energy.compute_energy()
+  
+
+def copy_bodies(locations, orientations):
+  '''
+  Copy the locations and orientations of the bodies to the GPU and
+  set the energy to zero, the copies are queued in the bodies stream.
+  Return the bodies buffers, they are only reallocated if the number
+  of bodies changes.
+  '''
+  global _bodies_buffers
+  number_of_bodies = np.int32(len(locations))
+
+  # Allocate pinned CPU memory and GPU memory if necessary
+  if _bodies_buffers is None or _bodies_buffers[0] != number_of_bodies:
+    x = cuda.pagelocked_empty(3 * number_of_bodies, np.float64)
+    q = cuda.pagelocked_empty(4 * number_of_bodies, np.float64)
+    U = cuda.pagelocked_empty(1, np.float64)
+    _bodies_buffers = (number_of_bodies, x, q, U, cuda.mem_alloc(x.nbytes), cuda.mem_alloc(q.nbytes), cuda.mem_alloc(U.nbytes), cuda.Stream())
+  number_of_bodies, x, q, U, x_gpu, q_gpu, u_gpu, stream = _bodies_buffers
+
+  # Copy location and orientation arrays to the pinned buffers
+  x[:] = np.reshape(locations, 3 * number_of_bodies)
+  q[:] = np.reshape(orientations, 4 * number_of_bodies)
+    
+  # Copy data to the GPU (host to device)
+  cuda.memcpy_htod_async(x_gpu, x, stream)
+  cuda.memcpy_htod_async(q_gpu, q, stream)
+  cuda.memset_d8_async(u_gpu, 0, U.nbytes, stream)
+  return _bodies_buffers
+
+
+def bodies_potential(locations, orientations, *args, **kwargs):
+  '''
+  This function compute the energy of the bodies.
+  The locations and orientations (quaternions) are given 
+  as arrays with shape (Nbodies, 3) and (Nbodies, 4).
+
+  The work is queued in its own stream, so it can run while
+  the blobs energy of a BlobEnergy object is computed.
   '''
+  # Copy data to the GPU
+  number_of_bodies, x, q, U, x_gpu, q_gpu, u_gpu, stream = copy_bodies(locations, orientations)
    
   # Determine number of threads and blocks for the GPU
-  number_of_blobs = np.int32(len(r_vectors))
-  threads_per_block, num_blocks = set_number_of_threads_and_blocks(number_of_blobs)
+  threads_per_block, num_blocks = set_number_of_threads_and_blocks(number_of_bodies)
 
   # Get parameters from arguments
   periodic_length = kwargs.get('periodic_length')
-  debye_length_wall = kwargs.get('debye_length_wall')
-  eps_wall = kwargs.get('repulsion_strength_wall')
-  debye_length = kwargs.get('debye_length')
-  eps = kwargs.get('repulsion_strength')
-  weight = kwargs.get('weight')
-  blob_radius = kwargs.get('blob_radius')  
-
-  # Reshape arrays
-  x = np.reshape(r_vectors, number_of_blobs * 3)
-        
-  # Allocate CPU memory
-  U = np.empty(number_of_blobs)
-
-  # Allocate GPU memory
-  utype = np.float64(1.)
-  x_gpu = cuda.mem_alloc(x.nbytes)
-  u_gpu = cuda.mem_alloc(U.nbytes)
-    
-  # Copy data to the GPU (host to device)
-  cuda.memcpy_htod(x_gpu, x)
-    
-  # Get pair interaction function
-  potential_from_position_blobs = mod.get_function("potential_from_position_blobs")
 
   # Compute pair interactions
-  potential_from_position_blobs(x_gpu, u_gpu,
-                                number_of_blobs,
-                                np.float64(periodic_length[0]),
-                                np.float64(periodic_length[1]),
-                                np.float64(debye_length_wall),
-                                np.float64(eps_wall),
-                                np.float64(debye_length),
-                                np.float64(eps),
-                                np.float64(weight),
-                                np.float64(blob_radius),
-                                block=(threads_per_block, 1, 1),
-                                grid=(num_blocks, 1)) 
+  potential_from_position_bodies = get_bodies_kernel()
+  potential_from_position_bodies.prepared_async_call((num_blocks, 1), (threads_per_block, 1, 1), stream,
+                                                     x_gpu, q_gpu, u_gpu,
+                                                     number_of_bodies,
+                                                     np.float64(periodic_length[0]),
+                                                     np.float64(periodic_length[1]))
     
   # Copy data from GPU to CPU (device to host)
-  cuda.memcpy_dtoh(U, u_gpu)
-  return np.sum(U)
-  
+  cuda.memcpy_dtoh_async(U, u_gpu, stream)
+  stream.synchronize()
+  return U[0]
 
-def bodies_potential(bodies, *args, **kwargs):
+
+def body_potential(locations, orientations, n, *args, **kwargs):
   '''
-  This function compute the energy of the bodies.
+  This function compute the energy of the body n, i.e. its one body
+  potential and its interactions with the other bodies. The cost is
+  O(Nbodies), so the change of the bodies energy when only the body n
+  moves is cheaper to compute than with bodies_potential.
   '''
-   
+  # Copy data to the GPU
+  number_of_bodies, x, q, U, x_gpu, q_gpu, u_gpu, stream = copy_bodies(locations, orientations)
+
   # Determine number of threads and blocks for the GPU
-  number_of_bodies = np.int32(len(bodies))
   threads_per_block, num_blocks = set_number_of_threads_and_blocks(number_of_bodies)
 
   # Get parameters from arguments
   periodic_length = kwargs.get('periodic_length')
 
-  # Create location and orientation arrays
-  x = np.empty(3 * number_of_bodies)
-  q = np.empty(4 * number_of_bodies)
-  for k, b in enumerate(bodies):
-    x[k*3 : (k+1)*3] = b.location_new
-    q[k*4] = b.orientation_new.s
-    q[k*4 + 1 : k*4 + 4] = b.orientation_new.p
-    
-  # Allocate CPU memory
-  U = np.empty(number_of_bodies)
-
-  # Allocate GPU memory
-  utype = np.float64(1.)
-  x_gpu = cuda.mem_alloc(x.nbytes)
-  q_gpu = cuda.mem_alloc(q.nbytes)
-  u_gpu = cuda.mem_alloc(U.nbytes)
-    
-  # Copy data to the GPU (host to device)
-  cuda.memcpy_htod(x_gpu, x)
-  cuda.memcpy_htod(q_gpu, q)
-    
-  # Get pair interaction function
-  potential_from_position_bodies = mod.get_function("potential_from_position_bodies")
+  # Compute the interactions of the body n
+  potential_from_position_bodies_partial = get_bodies_kernel('potential_from_position_bodies_partial', 'PPPiidd')
+  potential_from_position_bodies_partial.prepared_async_call((num_blocks, 1), (threads_per_block, 1, 1), stream,
+                                                             x_gpu, q_gpu, u_gpu,
+                                                             number_of_bodies,
+                                                             np.int32(n),
+                                                             np.float64(periodic_length[0]),
+                                                             np.float64(periodic_length[1]))
 
-  # Compute pair interactions
-  potential_from_position_bodies(x_gpu, q_gpu, u_gpu,
-                                 number_of_bodies,
-                                 np.float64(periodic_length[0]),
-                                 np.float64(periodic_length[1]),
-                                 block=(threads_per_block, 1, 1),
-                                 grid=(num_blocks, 1)) 
-    
   # Copy data from GPU to CPU (device to host)
-  cuda.memcpy_dtoh(U, u_gpu)
-  return np.sum(U)
+  cuda.memcpy_dtoh_async(U, u_gpu, stream)
+  stream.synchronize()
+  return U[0]
 
 
-def compute_total_energy(bodies, r_vectors, *args, **kwargs):
+def compute_total_energy(locations, orientations, r_vectors, *args, **kwargs):
   '''
   It computes and returns the total energy of the system as
   
@@ -345,7 +1320,7 @@ def compute_total_energy(bodies, r_vectors, *args, **kwargs):
   u_blobs = blobs_potential(r_vectors, *args, **kwargs)
 
   # Compute energy bodies
-  u_bodies = bodies_potential(bodies, *args, **kwargs)
+  u_bodies = bodies_potential(locations, orientations, *args, **kwargs)
 
   # Compute and return total energy
   return u_blobs + u_bodies
@@ -109,6 +109,8 @@ if __name__ == '__main__':
 
   # Create blobs coordinates array
   sample_r_vectors = get_blobs_r_vectors(bodies, Nblobs)
+  sample_locations = np.empty((num_bodies, 3))
+  sample_orientations = np.empty((num_bodies, 4))
 
   # quaternion to be used for disturbing the orientation of each body
   quaternion_shift = Quaternion(np.array([1,0,0,0]))
@@ -127,10 +129,13 @@ if __name__ == '__main__':
       body.location_new = np.random.uniform(0.0, max_translation, 3) 
       body.orientation_new.random_orientation()
       sample_r_vectors[blob_index : blob_index + bodies[i].Nblobs] = body.get_r_vectors(body.location_new, body.orientation_new)
+      sample_locations[i] = body.location_new
+      sample_orientations[i] = body.orientation_new.entries
       blob_index += body.Nblobs
 
     # calculate potential of proposed new state
-    sample_state_energy = pycuda.compute_total_energy(bodies,
+    sample_state_energy = pycuda.compute_total_energy(sample_locations,
+                                                      sample_orientations,
                                                       sample_r_vectors,
                                                       periodic_length = periodic_length,
                                                       debye_length_wall = read.debye_length_wall,
@@ -158,10 +163,13 @@ if __name__ == '__main__':
       body.location_new = np.random.uniform(0.0, max_translation, 3) 
       body.orientation_new.random_orientation()
       sample_r_vectors[blob_index : blob_index + bodies[i].Nblobs] = body.get_r_vectors(body.location_new, body.orientation_new)
+      sample_locations[i] = body.location_new
+      sample_orientations[i] = body.orientation_new.entries
       blob_index += body.Nblobs
 
     # calculate potential of proposed new state
-    sample_state_energy = pycuda.compute_total_energy(bodies,
+    sample_state_energy = pycuda.compute_total_energy(sample_locations,
+                                                      sample_orientations,
                                                       sample_r_vectors,
                                                       periodic_length = periodic_length,
                                                       debye_length_wall = read.debye_length_wall,
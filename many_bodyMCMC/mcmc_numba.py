@@ -0,0 +1,78 @@
+import numpy as np
+
+# Try to import numba
+try:
+  from numba import njit, prange
+except ImportError:
+  print('numba not found')
+
+
+@njit(parallel=True, fastmath=True)
+def propose_move_numba(locations, orientations, reference_configurations, blob_offsets, free_bodies, translations, rotations, locations_new, orientations_new, r_vectors):
+  '''
+  Disturb the location and orientation of the free bodies and
+  compute the blobs coordinates of the new configuration.
+
+  locations = (Nbodies, 3) array with the current locations.
+  orientations = (Nbodies, 4) array with the current orientations (quaternions).
+  reference_configurations = (Nblobs, 3) array with the reference configuration of all the bodies.
+  blob_offsets = (Nbodies + 1) array, the blobs of body n are blob_offsets[n]:blob_offsets[n+1].
+  free_bodies = (Nbodies) bool array, prescribed bodies are not disturbed.
+  translations = (Nbodies, 3) array with the displacements.
+  rotations = (Nbodies, 3) array with the rotation vectors.
+
+  The new locations, orientations and blobs coordinates are written
+  into locations_new, orientations_new and r_vectors.
+  '''
+  num_bodies = locations.shape[0]
+  for n in prange(num_bodies):
+    s = orientations[n, 0]
+    p0 = orientations[n, 1]
+    p1 = orientations[n, 2]
+    p2 = orientations[n, 3]
+    if free_bodies[n]:
+      # Quaternion shift from rotation vector
+      phi_norm = np.sqrt(rotations[n, 0]**2 + rotations[n, 1]**2 + rotations[n, 2]**2)
+      s_shift = np.cos(phi_norm / 2.0)
+      sin_shift = np.sin(phi_norm / 2.0) / phi_norm if phi_norm > 0 else 0.0
+      ps0 = sin_shift * rotations[n, 0]
+      ps1 = sin_shift * rotations[n, 1]
+      ps2 = sin_shift * rotations[n, 2]
+
+      # New orientation = quaternion_shift * orientation
+      s_new = s_shift * s - (ps0 * p0 + ps1 * p1 + ps2 * p2)
+      p0_new = s_shift * p0 + s * ps0 + ps1 * p2 - ps2 * p1
+      p1_new = s_shift * p1 + s * ps1 + ps2 * p0 - ps0 * p2
+      p2_new = s_shift * p2 + s * ps2 + ps0 * p1 - ps1 * p0
+      s, p0, p1, p2 = s_new, p0_new, p1_new, p2_new
+      for k in range(3):
+        locations_new[n, k] = locations[n, k] + translations[n, k]
+    else:
+      for k in range(3):
+        locations_new[n, k] = locations[n, k]
+    orientations_new[n, 0] = s
+    orientations_new[n, 1] = p0
+    orientations_new[n, 2] = p1
+    orientations_new[n, 3] = p2
+
+    # Rotation matrix, see Quaternion.rotation_matrix
+    diag = s**2 - 0.5
+    R00 = 2.0 * (p0 * p0 + diag)
+    R01 = 2.0 * (p0 * p1 - s * p2)
+    R02 = 2.0 * (p0 * p2 + s * p1)
+    R10 = 2.0 * (p1 * p0 + s * p2)
+    R11 = 2.0 * (p1 * p1 + diag)
+    R12 = 2.0 * (p1 * p2 - s * p0)
+    R20 = 2.0 * (p2 * p0 - s * p1)
+    R21 = 2.0 * (p2 * p1 + s * p0)
+    R22 = 2.0 * (p2 * p2 + diag)
+
+    # Blobs coordinates
+    for i in range(blob_offsets[n], blob_offsets[n+1]):
+      rx = reference_configurations[i, 0]
+      ry = reference_configurations[i, 1]
+      rz = reference_configurations[i, 2]
+      r_vectors[i, 0] = R00 * rx + R01 * ry + R02 * rz + locations_new[n, 0]
+      r_vectors[i, 1] = R10 * rx + R11 * ry + R12 * rz + locations_new[n, 1]
+      r_vectors[i, 2] = R20 * rx + R21 * ry + R22 * rz + locations_new[n, 2]
+  return
@@ -4,14 +4,10 @@ import numpy as np
 import scipy.sparse
 import sys
 import time
-import imp
+from importlib.util import find_spec
 
 # If pycuda is installed import mobility_pycuda
-try:
-  imp.find_module('pycuda')
-  found_pycuda = True
-except ImportError:
-  found_pycuda = False
+found_pycuda = find_spec('pycuda') is not None
 if found_pycuda:
   try:
     import pycuda.autoinit
@@ -25,11 +21,7 @@ if found_pycuda:
       from .mobility import mobility_pycuda
 
 # If numba is installed import mobility_numba
-try: 
-  imp.find_module('numba')
-  found_numba = True
-except ImportError:
-  found_numba = False
+found_numba = find_spec('numba') is not None
 if found_numba:
   try:
     from . import mobility_numba
@@ -1,13 +1,9 @@
 import numpy as np
 import sys
-import imp
+from importlib.util import find_spec
 from functools import partial
 
-try: 
-  imp.find_module('pycuda')
-  found_pycuda = True
-except ImportError:
-  found_pycuda = False
+found_pycuda = find_spec('pycuda') is not None
 try:
   import mobility_cpp
   found_cpp = True
@@ -44,15 +44,14 @@ def bodies_external_force_torque_new(bodies, r_vectors, *args, **kwargs):
   repulsion_strength_wall = kwargs.get('repulsion_strength_wall')
   debye_length_wall = kwargs.get('debye_length_wall')
   omega_one_roller = kwargs.get('omega_one_roller')
-  for k, b in enumerate(bodies):
-    # Add gravity and wall interaction
-    FT[2*k,2] += -g
-    FT[2*k+1,:] += 8.0*np.pi*eta*(particle_radius**3)*omega_one_roller
-    h = b.location[2]
-    if h > particle_radius:
-        FT[2*k,2] += (repulsion_strength_wall / debye_length_wall) * np.exp(-(h-particle_radius)/debye_length_wall)
-    else:
-        FT[2*k,2] += (repulsion_strength_wall / debye_length_wall)
+  # Heights of all the bodies
+  h = np.array([b.location[2] for b in bodies])
+
+  # Add gravity and wall interaction to all the bodies,
+  # the wall force is constant for h < particle_radius
+  FT[0::2,2] += -g
+  FT[0::2,2] += (repulsion_strength_wall / debye_length_wall) * np.exp(-np.maximum(h - particle_radius, 0.0) / debye_length_wall)
+  FT[1::2,:] += 8.0*np.pi*eta*(particle_radius**3)*omega_one_roller
   return FT
 multi_bodies_functions.bodies_external_force_torque = bodies_external_force_torque_new
 
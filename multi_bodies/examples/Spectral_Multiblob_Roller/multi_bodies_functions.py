@@ -6,7 +6,7 @@ bodies or the slip on the blobs.
 '''
 import numpy as np
 import sys
-import imp
+from importlib.util import find_spec
 import os.path
 from functools import partial
 import scipy.spatial as spatial
@@ -20,11 +20,7 @@ try:
 except ImportError:
   pass
 # If pycuda is installed import forces_pycuda
-try: 
-  imp.find_module('pycuda')
-  found_pycuda = True
-except ImportError:
-  found_pycuda = False
+found_pycuda = find_spec('pycuda') is not None
 if found_pycuda:
   try:
     import pycuda.autoinit
@@ -20,16 +20,11 @@ def calc_body_body_forces_torques_python_new(bodies, r_vectors, *args, **kwargs)
   # Get constant torque in the body frame of reference
   torque = kwargs.get('omega_one_roller')
   
-  # Loop over bodies and apply torque in the laboratory frame of reference
-  constant_torque_counter = 0
-  for i in range(Nbodies):
-    if bodies[i].ID == 'bacteria_constant_torque':
-      rotation_matrix = bodies[i].orientation.rotation_matrix()
-      if constant_torque_counter == 0:
-        force_torque_bodies[2*i + 1] = np.dot(rotation_matrix, torque)
-        constant_torque_counter = 1
-      else:
-        force_torque_bodies[2*i + 1] = -np.dot(rotation_matrix, torque)
-        constant_torque_counter = 0
+  # Rotate the torque to the laboratory frame of reference of all the bodies
+  # with constant torque, the sign alternates so the total torque is zero
+  indices = np.array([i for i in range(Nbodies) if bodies[i].ID == 'bacteria_constant_torque'], dtype=int)
+  if indices.size > 0:
+    sign = np.where(np.arange(indices.size) % 2 == 0, 1.0, -1.0)
+    force_torque_bodies[2*indices + 1] = sign[:,None] * rotate_vectors_bodies([bodies[i] for i in indices], torque)
   return force_torque_bodies
 multi_bodies_functions.calc_body_body_forces_torques_python = calc_body_body_forces_torques_python_new
@@ -45,6 +45,10 @@ __device__ void blob_blob_force(const double rx,
 
 /*
  This function computes the blob-blob force for all blobs.
+
+ The blobs coordinates are loaded in tiles of blockDim.x blobs
+ into shared memory, therefore the kernel has to be launched
+ with 3 * blockDim.x * sizeof(double) bytes of dynamic shared memory.
 */
 __global__ void calc_blob_blob_force(const double *x, 
                                      double *f, 
@@ -55,49 +59,69 @@ __global__ void calc_blob_blob_force(const double *x,
                                      const double Ly,
                                      const double Lz,
                                      const int number_of_blobs){
+  extern __shared__ double x_tile[];
   int i = blockDim.x * blockIdx.x + threadIdx.x;
-  if(i >= number_of_blobs) return;   
 
   int offset_i = i * 3;
-  int offset_j;
+  double xi = 0, yi = 0, zi = 0;
+  if(i < number_of_blobs){
+    xi = x[offset_i];
+    yi = x[offset_i + 1];
+    zi = x[offset_i + 2];
+  }
   double rx, ry, rz;
   double fx = 0;
   double fy = 0;
   double fz = 0;
 
-  // Loop over blobs to add interanctions
-  for(int j=0; j<number_of_blobs; j++){
-    offset_j = j * 3;
-
-    // Compute blob to blob vector
-    rx = x[offset_j]     - x[offset_i];
-    ry = x[offset_j + 1] - x[offset_i + 1];
-    rz = x[offset_j + 2] - x[offset_i + 2];
-
-    // Project a vector r to the minimal image representation
-    // centered around (0,0,0) and of size L=(Lx, Ly, Lz). If 
-    // any dimension of L is equal or smaller than zero the 
-    // box is assumed to be infinite in that direction.
-    if(Lx > 0){
-      rx = rx - int(rx / Lx + 0.5 * (int(rx>0) - int(rx<0))) * Lx;
-    }
-    if(Ly > 0){
-      ry = ry - int(ry / Ly + 0.5 * (int(ry>0) - int(ry<0))) * Ly;
+  // Loop over tiles of blobs to add interanctions.
+  // All the threads of the block load the tile, even if i >= number_of_blobs.
+  for(int tile_offset=0; tile_offset<number_of_blobs; tile_offset+=blockDim.x){
+    int j = tile_offset + threadIdx.x;
+    if(j < number_of_blobs){
+      x_tile[3 * threadIdx.x]     = x[j * 3];
+      x_tile[3 * threadIdx.x + 1] = x[j * 3 + 1];
+      x_tile[3 * threadIdx.x + 2] = x[j * 3 + 2];
     }
-    if(Lz > 0){
-      rz = rz - int(rz / Lz + 0.5 * (int(rz>0) - int(rz<0))) * Lz;
-    }
-
-    // Compute force between blobs i and j
-    if(i != j){
-      blob_blob_force(rx, ry, rz, fx, fy, fz, repulsion_strength, debye_length, blob_radius);
+    __syncthreads();
+
+    if(i < number_of_blobs){
+      int tile_size = min(int(blockDim.x), number_of_blobs - tile_offset);
+      for(int k=0; k<tile_size; k++){
+        // Compute blob to blob vector
+        rx = x_tile[3 * k]     - xi;
+        ry = x_tile[3 * k + 1] - yi;
+        rz = x_tile[3 * k + 2] - zi;
+
+        // Project a vector r to the minimal image representation
+        // centered around (0,0,0) and of size L=(Lx, Ly, Lz). If 
+        // any dimension of L is equal or smaller than zero the 
+        // box is assumed to be infinite in that direction.
+        if(Lx > 0){
+          rx = rx - int(rx / Lx + 0.5 * (int(rx>0) - int(rx<0))) * Lx;
+        }
+        if(Ly > 0){
+          ry = ry - int(ry / Ly + 0.5 * (int(ry>0) - int(ry<0))) * Ly;
+        }
+        if(Lz > 0){
+          rz = rz - int(rz / Lz + 0.5 * (int(rz>0) - int(rz<0))) * Lz;
+        }
+
+        // Compute force between blobs i and j
+        if(i != tile_offset + k){
+          blob_blob_force(rx, ry, rz, fx, fy, fz, repulsion_strength, debye_length, blob_radius);
+        }
+      }
     }
+    __syncthreads();
   }
   
   // Return forces
-  f[offset_i]     = fx;
-  f[offset_i + 1] = fy;
-  f[offset_i + 2] = fz;
+  if(i < number_of_blobs){
+    f[offset_i]     = fx;
+    f[offset_i + 1] = fy;
+    f[offset_i + 2] = fz;
+  }
 }
 """)
 
@@ -148,7 +172,7 @@ def calc_blob_blob_forces_pycuda(r_vectors, *args, **kwargs):
   force = mod.get_function("calc_blob_blob_force")
 
   # Compute mobility force product
-  force(x_gpu, f_gpu, np.float64(eps), np.float64(b), np.float64(blob_radius), np.float64(L[0]), np.float64(L[1]), np.float64(L[2]), number_of_blobs, block=(threads_per_block, 1, 1), grid=(num_blocks, 1)) 
+  force(x_gpu, f_gpu, np.float64(eps), np.float64(b), np.float64(blob_radius), np.float64(L[0]), np.float64(L[1]), np.float64(L[2]), number_of_blobs, block=(threads_per_block, 1, 1), grid=(num_blocks, 1), shared=3 * threads_per_block * x.itemsize) 
    
   # Copy data from GPU to CPU (device to host)
   cuda.memcpy_dtoh(f, f_gpu)
@@ -23,20 +23,13 @@ def bodies_external_force_torque_new(bodies, r_vectors, *args, **kwargs):
   repulsion_strength_wall = kwargs.get('repulsion_strength_wall') 
   debye_length_wall = kwargs.get('debye_length_wall')
 
-  # Loop over bodies
-  for k, b in enumerate(bodies):
-    f = np.zeros(3)
-    t = np.zeros(3)
-    # Add gravity
-    f -= g * blob_mass * np.array([0., 0., 1.0])
+  # Heights of all the bodies
+  h = np.array([b.location[2] for b in bodies])
 
-    # Add wall interaction
-    h = b.location[2]
-    if h > blob_radius:
-      f[2] += (repulsion_strength_wall / debye_length_wall) * np.exp(-(h-blob_radius)/debye_length_wall)
-    else:
-      f[2] += (repulsion_strength_wall / debye_length_wall)
-    force_torque_bodies[2*k:(2*k+1)] = f
+  # Add gravity and wall interaction to the forces of all the bodies, the torques are zero.
+  # The wall force is constant for h < blob_radius.
+  force_torque_bodies[0::2, 2] = -g * blob_mass
+  force_torque_bodies[0::2, 2] += (repulsion_strength_wall / debye_length_wall) * np.exp(-np.maximum(h - blob_radius, 0.0) / debye_length_wall)
  
   return force_torque_bodies
 multi_bodies_functions.bodies_external_force_torque = bodies_external_force_torque_new
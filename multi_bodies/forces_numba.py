@@ -4,7 +4,7 @@ import scipy.spatial as scsp
 
 # Try to import numba
 try:
-  from numba import njit, prange
+  from numba import njit, prange, get_num_threads
 except ImportError:
   print('numba not found')
 import general_application_utils as utils
@@ -29,28 +29,59 @@ def blob_blob_force_numba(r_vectors, L, eps, b, a):
 
   N = r_vectors.size // 3
   r_vectors = r_vectors.reshape((N, 3))
-  force = np.zeros((N, 3))
-
-  for i in prange(N):
-    for j in range(N):
-      if i == j:
-        continue
-
-      dr = np.zeros(3)
-      for k in range(3):
-        dr[k] = r_vectors[j,k] - r_vectors[i,k]
-        if L[k] > 0:
-          dr[k] -= int(dr[k] / L[k] + 0.5 * (int(dr[k]>0) - int(dr[k]<0))) * L[k]
-
-      # Compute force
-      r_norm = np.sqrt(dr[0]*dr[0] + dr[1]*dr[1] + dr[2]*dr[2])
-      if r_norm > 2*a:
-        f0 = -((eps / b) * np.exp(-(r_norm - 2.0*a) / b) / r_norm)
-      else:
-        f0 = -((eps / b) / np.maximum(r_norm, 1e-25))
 
-      for k in range(3):
-        force[i,k] += f0*dr[k]
+  # Copy arrays, the coordinates are stored as structure of arrays
+  rx_vec = np.copy(r_vectors[:,0])
+  ry_vec = np.copy(r_vectors[:,1])
+  rz_vec = np.copy(r_vectors[:,2])
+  Lx = L[0]
+  Ly = L[1]
+  Lz = L[2]
+  # Inverse periodic lengths, zero for non periodic directions
+  inv_Lx = 1.0 / Lx if Lx > 0 else 0.0
+  inv_Ly = 1.0 / Ly if Ly > 0 else 0.0
+  inv_Lz = 1.0 / Lz if Lz > 0 else 0.0
+  # Constants of the force, to avoid divisions in the loop
+  inv_b = 1.0 / b
+  eps_b = eps * inv_b
+
+  # Each pair is computed once and its force added to both blobs.
+  # The blobs i are distributed among num_chunks chunks, each one adds
+  # its forces to its own buffer and the buffers are added at the end.
+  num_chunks = max(min(get_num_threads(), N), 1)
+  force_chunks = np.zeros((num_chunks, N, 3))
+  for chunk in prange(num_chunks):
+    for i in range(chunk, N, num_chunks):
+      rxi = rx_vec[i]
+      ryi = ry_vec[i]
+      rzi = rz_vec[i]
+      for j in range(i+1, N):
+        rx = rx_vec[j] - rxi
+        ry = ry_vec[j] - ryi
+        rz = rz_vec[j] - rzi
+
+        # Use distance with PBC, no-op if inv_Lx = 0, ...
+        rx -= np.rint(rx * inv_Lx) * Lx
+        ry -= np.rint(ry * inv_Ly) * Ly
+        rz -= np.rint(rz * inv_Lz) * Lz
+
+        # Compute force
+        r_norm = np.sqrt(rx*rx + ry*ry + rz*rz)
+        if r_norm > 2*a:
+          f0 = -(eps_b * np.exp(-(r_norm - 2.0*a) * inv_b) / r_norm)
+        else:
+          f0 = -(eps_b / np.maximum(r_norm, 1e-25))
+        force_chunks[chunk, i, 0] += f0 * rx
+        force_chunks[chunk, i, 1] += f0 * ry
+        force_chunks[chunk, i, 2] += f0 * rz
+        force_chunks[chunk, j, 0] -= f0 * rx
+        force_chunks[chunk, j, 1] -= f0 * ry
+        force_chunks[chunk, j, 2] -= f0 * rz
+
+  # Add the forces of all the chunks
+  force = np.zeros((N, 3))
+  for chunk in range(num_chunks):
+    force += force_chunks[chunk]
 
   return force
 
@@ -95,29 +126,60 @@ def blob_blob_force_radii_numba(r_vectors, radius_blobs, L, eps, b, a):
   N = r_vectors.size // 3
   r_vectors = r_vectors.reshape((N, 3))
   radius_blobs = radius_blobs.reshape(N)
-  force = np.zeros((N, 3))  
 
-  for i in prange(N):
-    for j in range(N):
-      if i == j:
-        continue
-
-      dr = np.zeros(3)
-      for k in range(3):
-        dr[k] = r_vectors[j,k] - r_vectors[i,k]
-        if L[k] > 0:
-          dr[k] -= int(dr[k] / L[k] + 0.5 * (int(dr[k]>0) - int(dr[k]<0))) * L[k]
-
-      # Compute force
-      a = (radius_blobs[i] + radius_blobs[j]) * 0.5
-      r_norm = np.sqrt(dr[0]*dr[0] + dr[1]*dr[1] + dr[2]*dr[2])
-      if r_norm > 2*a:
-        f0 = -((eps / b) * np.exp(-(r_norm - 2.0*a) / b) / r_norm)
-      else:
-        f0 = -((eps / b) / np.maximum(r_norm, 1e-25))
-
-      for k in range(3):
-        force[i,k] += f0*dr[k]
+  # Copy arrays, the coordinates are stored as structure of arrays
+  rx_vec = np.copy(r_vectors[:,0])
+  ry_vec = np.copy(r_vectors[:,1])
+  rz_vec = np.copy(r_vectors[:,2])
+  Lx = L[0]
+  Ly = L[1]
+  Lz = L[2]
+  # Inverse periodic lengths, zero for non periodic directions
+  inv_Lx = 1.0 / Lx if Lx > 0 else 0.0
+  inv_Ly = 1.0 / Ly if Ly > 0 else 0.0
+  inv_Lz = 1.0 / Lz if Lz > 0 else 0.0
+  # Constants of the force, to avoid divisions in the loop
+  inv_b = 1.0 / b
+  eps_b = eps * inv_b
+
+  # Each pair is computed once and its force added to both blobs.
+  # The blobs i are distributed among num_chunks chunks, each one adds
+  # its forces to its own buffer and the buffers are added at the end.
+  num_chunks = max(min(get_num_threads(), N), 1)
+  force_chunks = np.zeros((num_chunks, N, 3))
+  for chunk in prange(num_chunks):
+    for i in range(chunk, N, num_chunks):
+      rxi = rx_vec[i]
+      ryi = ry_vec[i]
+      rzi = rz_vec[i]
+      for j in range(i+1, N):
+        rx = rx_vec[j] - rxi
+        ry = ry_vec[j] - ryi
+        rz = rz_vec[j] - rzi
+
+        # Use distance with PBC, no-op if inv_Lx = 0, ...
+        rx -= np.rint(rx * inv_Lx) * Lx
+        ry -= np.rint(ry * inv_Ly) * Ly
+        rz -= np.rint(rz * inv_Lz) * Lz
+
+        # Compute force
+        a = (radius_blobs[i] + radius_blobs[j]) * 0.5
+        r_norm = np.sqrt(rx*rx + ry*ry + rz*rz)
+        if r_norm > 2*a:
+          f0 = -(eps_b * np.exp(-(r_norm - 2.0*a) * inv_b) / r_norm)
+        else:
+          f0 = -(eps_b / np.maximum(r_norm, 1e-25))
+        force_chunks[chunk, i, 0] += f0 * rx
+        force_chunks[chunk, i, 1] += f0 * ry
+        force_chunks[chunk, i, 2] += f0 * rz
+        force_chunks[chunk, j, 0] -= f0 * rx
+        force_chunks[chunk, j, 1] -= f0 * ry
+        force_chunks[chunk, j, 2] -= f0 * rz
+
+  # Add the forces of all the chunks
+  force = np.zeros((N, 3))
+  for chunk in range(num_chunks):
+    force += force_chunks[chunk]
 
   return force
 
@@ -167,6 +229,13 @@ def blob_blob_force_tree_numba(r_vectors, L, eps, b, a, list_of_neighbors, offse
   Lx = L[0]
   Ly = L[1]
   Lz = L[2]
+  # Inverse periodic lengths, zero for non periodic directions
+  inv_Lx = 1.0 / Lx if Lx > 0 else 0.0
+  inv_Ly = 1.0 / Ly if Ly > 0 else 0.0
+  inv_Lz = 1.0 / Lz if Lz > 0 else 0.0
+  # Constants of the force, to avoid divisions in the loop
+  inv_b = 1.0 / b
+  eps_b = eps * inv_b
 
   for i in prange(N):
     for k in range(offsets[i+1] - offsets[i]):
@@ -177,20 +246,17 @@ def blob_blob_force_tree_numba(r_vectors, L, eps, b, a, list_of_neighbors, offse
       ry = ry_vec[j] - ry_vec[i]
       rz = rz_vec[j] - rz_vec[i]
 
-      # Use distance with PBC
-      if Lx > 0:
-        rx = rx - int(rx / Lx + 0.5 * (int(rx>0) - int(rx<0))) * Lx
-      if Ly > 0:
-        ry = ry - int(ry / Ly + 0.5 * (int(ry>0) - int(ry<0))) * Ly
-      if Lz > 0:
-        rz = rz - int(rz / Lz + 0.5 * (int(rz>0) - int(rz<0))) * Lz
+      # Use distance with PBC, no-op if inv_Lx = 0, ...
+      rx -= np.rint(rx * inv_Lx) * Lx
+      ry -= np.rint(ry * inv_Ly) * Ly
+      rz -= np.rint(rz * inv_Lz) * Lz
 
       # Compute force
       r_norm = np.sqrt(rx*rx + ry*ry + rz*rz)
       if r_norm > 2*a:
-        f0 = -((eps / b) * np.exp(-(r_norm - 2.0*a) / b) / r_norm)
+        f0 = -(eps_b * np.exp(-(r_norm - 2.0*a) * inv_b) / r_norm)
       else:
-        f0 = -((eps / b) / np.maximum(r_norm, 1e-25))
+        f0 = -(eps_b / np.maximum(r_norm, 1e-25))
       force[i, 0] += f0 * rx
       force[i, 1] += f0 * ry
       force[i, 2] += f0 * rz
@@ -7,7 +7,7 @@ bodies or the slip on the blobs.
 
 import numpy as np
 import sys
-import imp
+from importlib.util import find_spec
 import os.path
 from functools import partial
 
@@ -15,11 +15,7 @@ import general_application_utils as utils
 from quaternion_integrator.quaternion import Quaternion
 
 # If pycuda is installed import forces_pycuda
-try: 
-  imp.find_module('pycuda')
-  found_pycuda = True
-except ImportError:
-  found_pycuda = False
+found_pycuda = find_spec('pycuda') is not None
 
 if found_pycuda:
   try:
@@ -33,11 +29,7 @@ if found_pycuda:
     except ImportError:
       from .multi_bodies import forces_pycuda
 # If numba is installed import forces_numba
-try: 
-  imp.find_module('numba')
-  found_numba = True
-except ImportError:
-  found_numba = False
+found_numba = find_spec('numba') is not None
 if found_numba:
   import forces_numba
 try:
@@ -140,6 +132,28 @@ def active_body_slip(body, slip):
   return slip_rotated
 
 
+def rotate_vectors_bodies(bodies, vectors):
+  '''
+  Rotate vectors given in the body frame of reference
+  (quaternion = (1,0,0,0)) to the laboratory frame of reference.
+  vectors can have shape (3) (the same vector for all the bodies)
+  or (len(bodies), 3). It returns an array with shape (len(bodies), 3).
+
+  The quaternions q = (s, p) of all the bodies are rotated at once
+  with the closed form
+
+  R(q) * v = v + 2 * s * (p x v) + 2 * p x (p x v)
+
+  so the rotation matrices are not built.
+  '''
+  q = np.array([b.orientation.entries for b in bodies]).reshape((len(bodies), 4))
+  s = q[:,0:1]
+  p = q[:,1:4]
+  v = np.broadcast_to(vectors, p.shape)
+  p_cross_v = np.cross(p, v)
+  return v + 2.0 * s * p_cross_v + 2.0 * np.cross(p, p_cross_v)
+
+
 def bodies_external_force_torque(bodies, r_vectors, *args, **kwargs):
   '''
   This function returns the external force-torques acting on the bodies.
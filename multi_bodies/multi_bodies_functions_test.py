@@ -0,0 +1,42 @@
+''' Test the functions of multi_bodies_functions.py. '''
+
+import unittest
+import numpy as np
+import sys
+sys.path.append('..')
+
+from body import body
+from quaternion_integrator.quaternion import Quaternion
+import multi_bodies_functions as mbf
+
+
+class TestMultiBodiesFunctions(unittest.TestCase):
+
+  def setUp(self):
+    ''' Create bodies with random orientations. '''
+    self.bodies = []
+    for i in range(7):
+      q = np.random.normal(0., 1., 4)
+      self.bodies.append(body.Body(np.random.rand(3), Quaternion(q / np.linalg.norm(q)), np.random.rand(2, 3), 0.5))
+
+  def test_rotate_vectors_bodies_one_vector(self):
+    ''' Test that rotate_vectors_bodies rotates one vector like the rotation matrices. '''
+    vector = np.random.normal(0., 1., 3)
+    vectors_rotated = mbf.rotate_vectors_bodies(self.bodies, vector)
+    for i, b in enumerate(self.bodies):
+      v = np.dot(b.orientation.rotation_matrix(), vector)
+      for k in range(3):
+        self.assertAlmostEqual(vectors_rotated[i, k], v[k])
+
+  def test_rotate_vectors_bodies_one_vector_per_body(self):
+    ''' Test that rotate_vectors_bodies rotates one vector per body like the rotation matrices. '''
+    vectors = np.random.normal(0., 1., (len(self.bodies), 3))
+    vectors_rotated = mbf.rotate_vectors_bodies(self.bodies, vectors)
+    for i, b in enumerate(self.bodies):
+      v = np.dot(b.orientation.rotation_matrix(), vectors[i])
+      for k in range(3):
+        self.assertAlmostEqual(vectors_rotated[i, k], v[k])
+
+
+if __name__ == '__main__':
+  unittest.main()
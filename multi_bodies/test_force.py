@@ -1,30 +1,21 @@
 
 import numpy as np
 import sys
-import imp
+from importlib.util import find_spec
 sys.path.append('../')
 
 from general_application_utils import timer
 import forces_numba
 import multi_bodies_functions as mbf
 
-try: 
-  imp.find_module('pycuda')
-  found_pycuda = True
-except ImportError:
-  found_pycuda = False
-if found_pycuda:
-  from . import forces_pycuda   
-
-try:
-  import forces_cpp
-  found_cpp = True
-except ImportError:
-  found_cpp = False
-  pass
+found_pycuda = find_spec('pycuda') is not None
+found_cpp = find_spec('forces_cpp') is not None
 
 
 if __name__ == '__main__':
+  # Import the optional implementations only when they are used
+  if found_pycuda:
+    import forces_pycuda
   print('# Start')
 
   N = 100
@@ -32,12 +23,15 @@ if __name__ == '__main__':
   b = 0.01
   eps = 3.92
   L = np.array([0.0, 0.0, 0.0])
-  r_vectors = np.random.rand(N, 3) * 10.0
+  rng = np.random.default_rng(0)
+  r_vectors = rng.random((N, 3)) * 10.0
 
   if found_pycuda:
-    force_pycuda = forces_pycuda.calc_blob_blob_forces_pycuda(r_vectors, blob_radius=a, debye_length=b, repulsion_strength=eps, periodic_length=L)
+    # The pycuda kernel works with the type real (float32 by default), convert the positions before timing
+    r_vectors_real = np.ascontiguousarray(r_vectors, dtype=forces_pycuda.real(0).dtype)
+    force_pycuda = forces_pycuda.calc_blob_blob_forces_pycuda(r_vectors_real, blob_radius=a, debye_length=b, repulsion_strength=eps, periodic_length=L)
     timer('pycuda')
-    force_pycuda = forces_pycuda.calc_blob_blob_forces_pycuda(r_vectors, blob_radius=a, debye_length=b, repulsion_strength=eps, periodic_length=L)
+    force_pycuda = forces_pycuda.calc_blob_blob_forces_pycuda(r_vectors_real, blob_radius=a, debye_length=b, repulsion_strength=eps, periodic_length=L)
     timer('pycuda')
 
   force_numba_tree = forces_numba.calc_blob_blob_forces_tree_numba(r_vectors+1, blob_radius=a, debye_length=b, repulsion_strength=eps, periodic_length=L)
@@ -58,6 +52,7 @@ if __name__ == '__main__':
     timer('python')
 
   if found_cpp:
+    force_cpp = mbf.calc_blob_blob_forces_cpp(r_vectors, blob_radius=a, debye_length=b, repulsion_strength=eps, periodic_length=L)
     timer('cpp')
     force_cpp = mbf.calc_blob_blob_forces_cpp(r_vectors, blob_radius=a, debye_length=b, repulsion_strength=eps, periodic_length=L)
     timer('cpp')
@@ -0,0 +1,73 @@
+'''
+Compare the numba blob-blob force kernels with the original
+implementation, which visits every pair (i, j) twice, with and
+without periodic boundary conditions.
+'''
+import numpy as np
+import sys
+sys.path.append('../')
+
+from numba import njit
+import forces_numba
+
+
+@njit
+def blob_blob_force_reference(r_vectors, radius_blobs, L, eps, b):
+  '''
+  Original all pairs kernel. The force on blob i is the sum over
+  all blobs j != i, the effective radius of a pair is the average
+  of the blobs radii.
+  '''
+  N = r_vectors.shape[0]
+  force = np.zeros((N, 3))
+  inv_Lx = 1.0 / L[0] if L[0] > 0 else 0.0
+  inv_Ly = 1.0 / L[1] if L[1] > 0 else 0.0
+  inv_Lz = 1.0 / L[2] if L[2] > 0 else 0.0
+  for i in range(N):
+    for j in range(N):
+      if i == j:
+        continue
+      rx = r_vectors[j, 0] - r_vectors[i, 0]
+      ry = r_vectors[j, 1] - r_vectors[i, 1]
+      rz = r_vectors[j, 2] - r_vectors[i, 2]
+      rx -= np.rint(rx * inv_Lx) * L[0]
+      ry -= np.rint(ry * inv_Ly) * L[1]
+      rz -= np.rint(rz * inv_Lz) * L[2]
+      a = (radius_blobs[i] + radius_blobs[j]) * 0.5
+      r_norm = np.sqrt(rx*rx + ry*ry + rz*rz)
+      if r_norm > 2*a:
+        f0 = -(eps / b * np.exp(-(r_norm - 2.0*a) / b) / r_norm)
+      else:
+        f0 = -(eps / b / np.maximum(r_norm, 1e-25))
+      force[i, 0] += f0 * rx
+      force[i, 1] += f0 * ry
+      force[i, 2] += f0 * rz
+  return force
+
+
+if __name__ == '__main__':
+  print('# Start')
+
+  N = 500
+  a = 0.13
+  b = 0.1
+  eps = 3.92
+  tolerance = 1e-12
+  rng = np.random.default_rng(0)
+  r_vectors = rng.random((N, 3)) * 5.0
+  radius_blobs = a * (0.5 + rng.random(N))
+
+  for L in [np.array([0.0, 0.0, 0.0]), np.array([5.0, 5.0, 0.0]), np.array([5.0, 5.0, 5.0])]:
+    force_reference = blob_blob_force_reference(r_vectors, np.ones(N) * a, L, eps, b)
+    force_numba = forces_numba.calc_blob_blob_forces_numba(r_vectors, blob_radius=a, debye_length=b, repulsion_strength=eps, periodic_length=L)
+    error = np.linalg.norm(force_numba - force_reference) / np.linalg.norm(force_reference)
+    print('L = ', L, ', |f_numba - f_reference| / |f_reference| = ', error)
+    assert error < tolerance
+
+    force_reference = blob_blob_force_reference(r_vectors, radius_blobs, L, eps, b)
+    force_numba = forces_numba.calc_blob_blob_forces_radii_numba(r_vectors, radius_blobs, blob_radius=a, debye_length=b, repulsion_strength=eps, periodic_length=L)
+    error = np.linalg.norm(force_numba - force_reference) / np.linalg.norm(force_reference)
+    print('L = ', L, ', |f_radii_numba - f_reference| / |f_reference| = ', error)
+    assert error < tolerance
+
+  print('# End')
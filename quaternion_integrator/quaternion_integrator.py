@@ -5,6 +5,37 @@ Simple integrator for N quaternions.
 import numpy as np
 from .quaternion import Quaternion
 
+
+def rotate_orientations(orientation, rotations):
+  '''
+  Rotate the list of quaternions orientation by the rotation
+  vectors rotations (shape (3*len(orientation))), i.e. return the list
+  
+  [Quaternion.from_rotation(rotations[3*i:3*i+3]) * orientation[i]]
+  
+  The rotation quaternions and the products are computed
+  for all the quaternions at once.
+  '''
+  N = len(orientation)
+  q = np.array([theta.entries for theta in orientation], dtype=float).reshape((N, 4))
+  phi = np.reshape(rotations, (N, 3))
+  phi_norm = np.linalg.norm(phi, axis=1)
+
+  # Quaternions representing the rotations phi
+  s_dt = np.cos(phi_norm / 2.0)
+  p_dt = np.zeros((N, 3))
+  sel = phi_norm > 0
+  p_dt[sel] = (np.sin(phi_norm[sel] / 2.0) / phi_norm[sel])[:,None] * phi[sel]
+
+  # Product (s_dt, p_dt) * (s, p)
+  s = q[:,0]
+  p = q[:,1:4]
+  q_new = np.empty((N, 4))
+  q_new[:,0] = s_dt * s - np.einsum('ij,ij->i', p_dt, p)
+  q_new[:,1:4] = s_dt[:,None] * p + s[:,None] * p_dt + np.cross(p_dt, p)
+  return [Quaternion(x) for x in q_new]
+
+
 class QuaternionIntegrator(object):
   '''
   Integrator that timesteps using Fixman quaternion updates.
@@ -87,11 +118,8 @@ class QuaternionIntegrator(object):
         omega = (np.dot(mobility, torque) + 
                np.sqrt(4.0*self.kT/dt)*np.dot(mobility_half, noise))
         
-      # Update each quaternion at a time.
-      orientation_midpoint = []
-      for i in range(self.dim):
-        quaternion_dt = Quaternion.from_rotation((omega[(i*3):(i*3+3)])*dt/2.)
-        orientation_midpoint.append(quaternion_dt*self.orientation[i])
+      # Update all the quaternions.
+      orientation_midpoint = rotate_orientations(self.orientation, omega*dt/2.)
 
       if self.has_location:
         location_midpoint = self.location + 0.5*dt*velocity
@@ -123,10 +151,7 @@ class QuaternionIntegrator(object):
           np.dot(mobility_tilde, torque_tilde) + np.sqrt(self.kT/dt)*
           np.dot(mobility_tilde, np.dot(mobility_half_inv.T, noise)))
         
-      new_orientation = []
-      for i in range(self.dim):
-        quaternion_dt = Quaternion.from_rotation((omega_tilde[(i*3):(i*3+3)])*dt)
-        new_orientation.append(quaternion_dt*self.orientation[i])
+      new_orientation = rotate_orientations(self.orientation, omega_tilde*dt)
 
       # Check that the new state is admissible. Re-take the step 
       # (with tail recursion) if the new state is invalid.
@@ -154,13 +179,8 @@ class QuaternionIntegrator(object):
         rfd_noise = np.random.normal(0.0, 1.0, self.dim*6)
         # Calculate RFD location.
         rfd_location = self.location + self.rf_delta*rfd_noise[0:3*self.dim]
-        # Update each quaternion at a time for RFD orientation.
-        rfd_orientation = []
-        for i in range(self.dim):
-          quaternion_dt = Quaternion.from_rotation((self.rf_delta*
-                                                    rfd_noise[(3*self.dim + i*3):
-                                                              (3*self.dim + i*3+3)]))
-          rfd_orientation.append(quaternion_dt*self.orientation[i])
+        # Update all the quaternions for RFD orientation.
+        rfd_orientation = rotate_orientations(self.orientation, self.rf_delta*rfd_noise[3*self.dim:6*self.dim])
 
         # divergence term d_x(N) : \Psi^T 
         divergence_term = self.kT*np.dot(
@@ -188,12 +208,8 @@ class QuaternionIntegrator(object):
         torque = self.torque_calculator(self.orientation)
         
         noise = np.random.normal(0.0, 1.0, self.dim*3)
-        # Update each quaternion at a time for rfd orientation.
-        rfd_orientation = []
-        for i in range(self.dim):
-          quaternion_dt = Quaternion.from_rotation((self.rf_delta*
-                                                    rfd_noise[(i*3):(i*3+3)]))
-          rfd_orientation.append(quaternion_dt*self.orientation[i])
+        # Update all the quaternions for rfd orientation.
+        rfd_orientation = rotate_orientations(self.orientation, self.rf_delta*rfd_noise)
 
         # divergence term d_x(M) : \Psi^T 
         divergence_term = self.kT*np.dot(
@@ -205,10 +221,7 @@ class QuaternionIntegrator(object):
                  divergence_term)
 
       # For with location and without location, we update orientation the same way.
-      new_orientation = []
-      for i in range(self.dim):
-        quaternion_dt = Quaternion.from_rotation((omega[(i*3):(i*3+3)])*dt)
-        new_orientation.append(quaternion_dt*self.orientation[i])
+      new_orientation = rotate_orientations(self.orientation, omega*dt)
         
       # Check validity of new state.
       if self.has_location:
@@ -242,10 +255,7 @@ class QuaternionIntegrator(object):
       velocity = velocity_and_omega[0:(3*self.dim)]
       omega = velocity_and_omega[(3*self.dim):(6*self.dim)]
       new_location = self.location + dt*velocity
-      new_orientation = []
-      for i in range(self.dim):
-        quaternion_dt = Quaternion.from_rotation((omega[(i*3):(i*3+3)])*dt)
-        new_orientation.append(quaternion_dt*self.orientation[i])
+      new_orientation = rotate_orientations(self.orientation, omega*dt)
       if self.check_new_state(new_location, new_orientation):
         self.successes += 1
         self.orientation = new_orientation
@@ -257,10 +267,7 @@ class QuaternionIntegrator(object):
       noise = np.random.normal(0.0, 1.0, self.dim*3)
       omega = (np.dot(mobility, torque) + 
                np.sqrt(2.0*self.kT/dt)*np.dot(mobility_half, noise))
-      new_orientation = []
-      for i in range(self.dim):
-        quaternion_dt = Quaternion.from_rotation((omega[(i*3):(i*3+3)])*dt)
-        new_orientation.append(quaternion_dt*self.orientation[i])
+      new_orientation = rotate_orientations(self.orientation, omega*dt)
 
       if self.check_new_state(None, new_orientation):
         self.successes += 1
@@ -311,8 +318,9 @@ class QuaternionIntegrator(object):
     self.torque_calculator = zero_torque
     initial_orientation = self.orientation
 
-    drift_samples = []
-    covariance_samples = []
+    # Accumulate the sums of the samples instead of storing them
+    drift_sum = 0.0
+    covariance_sum = 0.0
     for k in range(n_steps):
       if scheme == 'FIXMAN':
         self.fixman_time_step(dt)
@@ -326,14 +334,14 @@ class QuaternionIntegrator(object):
         drift = orientation_increment.rotation_angle()
         if self.has_location:
           drift = np.concatenate([self.location[l] - initial_location[l], drift])
-      drift_samples.append(drift)
-      covariance_samples.append(np.outer(drift, drift))
+      drift_sum += drift
+      covariance_sum += np.outer(drift, drift)
       self.orientation = initial_orientation
       if self.has_location:
         self.location = initial_location
 
-    avg_drift = np.mean(drift_samples, axis=0)/dt
-    avg_covariance = np.mean(covariance_samples, axis=0)/(2.*dt)
+    avg_drift = drift_sum/(n_steps*dt)
+    avg_covariance = covariance_sum/(n_steps*2.*dt)
 
     # Reset torque calculator
     self.torque_calculator = old_torque
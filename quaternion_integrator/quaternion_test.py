@@ -1,7 +1,12 @@
 import unittest
 import numpy as np
 import random
+import sys
+# Put the parent folder first, the file quaternion_integrator.py
+# of this folder would hide the package quaternion_integrator
+sys.path.insert(0, '..')
 from quaternion import Quaternion
+from quaternion_integrator.quaternion_integrator import rotate_orientations
 
 class TestQuaternion(unittest.TestCase):
 
@@ -192,6 +197,21 @@ class TestQuaternion(unittest.TestCase):
     self.assertAlmostEqual(max_orthogonal_err, 0.0)
 
 
+  def test_rotate_orientations(self):
+    ''' Test that rotate_orientations agrees with the product of quaternions. '''
+    N = 20
+    q = np.random.normal(0., 1., (N, 4))
+    orientation = [Quaternion(x / np.linalg.norm(x)) for x in q]
+    rotations = np.random.normal(0., 1., 3 * N)
+    # Include a zero rotation
+    rotations[0:3] = 0.
+    orientation_new = rotate_orientations(orientation, rotations)
+    for i in range(N):
+      theta = Quaternion.from_rotation(rotations[3*i : 3*i+3]) * orientation[i]
+      for k in range(4):
+        self.assertAlmostEqual(orientation_new[i].entries[k], theta.entries[k])
+
+
     
 if __name__ == '__main__':
   unittest.main()
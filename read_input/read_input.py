@@ -78,6 +78,16 @@ class ReadInput(object):
     self.nonlinear_solver_tolerance = float(self.options.get('nonlinear_solver_tolerance') or 1e-08)
     self.rf_delta = float(self.options.get('rf_delta') or 1e-03)
     self.save_clones = str(self.options.get('save_clones') or 'one_file_per_step')
+    self.mcmc_move = str(self.options.get('mcmc_move') or 'all_bodies')
+    self.mcmc_precision = str(self.options.get('mcmc_precision') or 'double')
+    self.mcmc_cell_list = str(self.options.get('mcmc_cell_list') or 'False')
+    self.mcmc_specialize = str(self.options.get('mcmc_specialize') or 'False')
+    self.mcmc_cutoff = str(self.options.get('mcmc_cutoff') or 'None')
+    self.mcmc_cell_skin = str(self.options.get('mcmc_cell_skin') or 'None')
+    self.mcmc_cuda_graph = str(self.options.get('mcmc_cuda_graph') or 'False')
+    self.mcmc_chains = int(self.options.get('mcmc_chains') or 1)
+    self.mcmc_kT_max = float(self.options.get('mcmc_kT_max') or self.kT)
+    self.mcmc_swap_interval = int(self.options.get('mcmc_swap_interval') or 10)
     self.periodic_length = np.fromstring(self.options.get('periodic_length') or '0 0 0', sep=' ')
     self.omega_one_roller = np.fromstring(self.options.get('omega_one_roller') or '0 0 0', sep=' ')
     self.free_kinematics = str(self.options.get('free_kinematics') or 'True')
@@ -118,6 +118,56 @@ def non_sphere_rejection(partitionZ):
 
 
 
+def non_sphere_GB_batch(heights, orientations, blob_distance = .525):
+	'''
+	Return exp(-U/kT) for the locations (0, 0, heights) and the orientations
+	(array with shape (len(heights), 4)) of many boomerangs at once.
+	Only the heights of the blobs are needed, and since the boomerang lies
+	in the x-y plane of its reference configuration they are
+	h + R[2,0] * x_k + R[2,1] * y_k, see get_boomerang_r_vectors.
+	'''
+	x = blob_distance * np.array([3., 2., 1., 0., 0., 0., 0.])
+	y = blob_distance * np.array([0., 0., 0., 0., 1., 2., 3.])
+	s = orientations[:,0]
+	p = orientations[:,1:4]
+	R20 = 2.0 * (p[:,2]*p[:,0] - s*p[:,1])
+	R21 = 2.0 * (p[:,2]*p[:,1] + s*p[:,0])
+	z = heights[:,None] + R20[:,None] * x + R21[:,None] * y
+
+	# Add gravity and repulsion to potential, blobs below A give exp(-U/kT) = 0
+	with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+		U = np.sum(np.array(WEIGHT) * z + REPULSION_STRENGTH * np.exp(-1.*(z - A)/DEBYE_LENGTH) / (z - A), axis=1)
+		GB = np.exp(-1. * U/KT)
+	GB[np.any(z < A, axis=1)] = 0.0
+	return GB
+
+
+def non_sphere_rejection_batch(partitionZ, n, batch_size=1000):
+	'''
+	Rejection algorithm for n samples at once. Locations and orientations are
+	generated and accepted in batches of batch_size with array operations,
+	until n samples are accepted. It returns the heights (shape (n)) and
+	the orientations (shape (n, 4)) of the samples.
+	'''
+	heights = np.empty(n)
+	orientations = np.empty((n, 4))
+	count = 0
+	while count < n:
+		theta = np.random.normal(0., 1., (batch_size, 4))
+		theta = theta / np.linalg.norm(theta, axis=1)[:,None]
+		new_heights = np.random.uniform(A, max_height-A, batch_size)
+		acceptance_prob = non_sphere_GB_batch(new_heights, theta) / partitionZ
+		if np.any(acceptance_prob > 1):
+			raise InvalidProbability('Acceptance Probability is greater than 1')
+		accepted = np.random.uniform(0., 1., batch_size) < acceptance_prob
+		num_accepted = min(np.count_nonzero(accepted), n - count)
+		heights[count:count+num_accepted] = new_heights[accepted][0:num_accepted]
+		orientations[count:count+num_accepted] = theta[accepted][0:num_accepted]
+		count += num_accepted
+	return heights, orientations
+
+
+
 # calculate an num_points numbver of points given by directly computing the Gibbs-Boltzmann distribution
 # P(h) = exp(-U(h)/KT) / integral(exp(U(h)/KT)dh)
 # calculated using the trapezoidal rule
@@ -0,0 +1,45 @@
+''' Test the rejection algorithm for a boomerang next to a wall. '''
+
+import unittest
+import numpy as np
+import sys
+sys.path.append('..')
+from quaternion_integrator.quaternion import Quaternion
+import non_sphere as ns
+
+
+class TestNonSphere(unittest.TestCase):
+
+  def setUp(self):
+    np.random.seed(0)
+
+  def test_GB_batch(self):
+    ''' Test that non_sphere_GB_batch gives the same values as non_sphere_GB. '''
+    n = 2000
+    orientations = np.random.normal(0., 1., (n, 4))
+    orientations = orientations / np.linalg.norm(orientations, axis=1)[:,None]
+    heights = np.random.uniform(ns.A, ns.max_height, n)
+    GB_batch = ns.non_sphere_GB_batch(heights, orientations)
+    for i in range(n):
+      GB = ns.non_sphere_GB(np.array([0., 0., heights[i]]), Quaternion(orientations[i]))
+      if GB == 0:
+        self.assertEqual(GB_batch[i], 0.0)
+      else:
+        self.assertAlmostEqual(GB_batch[i] / GB, 1.0, places=10)
+
+  def test_rejection_batch_statistics(self):
+    ''' Test that non_sphere_rejection_batch samples the heights like non_sphere_rejection. '''
+    n = 3000
+    partitionZ = 2 * ns.generate_non_sphere_partition(2000)
+    heights = np.array([ns.non_sphere_rejection(partitionZ)[0][2] for i in range(n)])
+    heights_batch, orientations_batch = ns.non_sphere_rejection_batch(partitionZ, n)
+
+    # Compare the mean and the standard deviation within 4 standard errors
+    std_error = np.sqrt((np.var(heights) + np.var(heights_batch)) / n)
+    self.assertLess(abs(np.mean(heights) - np.mean(heights_batch)), 4 * std_error)
+    self.assertLess(abs(np.std(heights) - np.std(heights_batch)), 4 * std_error)
+    self.assertAlmostEqual(np.max(np.abs(np.linalg.norm(orientations_batch, axis=1) - 1.0)), 0.0)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -30,7 +30,6 @@ location = [0., 0., 1.1] # the position of the particle
 #sample = [location, orientation]
 
 n_steps = 10000 # the number of height positions to be generated
-f = open(outFile, 'w')
 
 start_time = time.time() 
 
@@ -42,12 +41,10 @@ partition_steps = 10000
 partition_constant = 1.1
 partitionZ = s.generate_non_sphere_partition(partition_steps) * partition_constant
 
-for i in range(n_steps):
-	# get a position from rejection function
-	sample_state = s.non_sphere_rejection(partitionZ)
-	# send that position to the data file
-	f.write(str(sample_state[0][2]) + '\n')
-f.close()
+# get all the heights from the batch rejection function
+heights, orientations = s.non_sphere_rejection_batch(partitionZ, n_steps)
+# send all the heights to the data file at once
+np.savetxt(outFile, heights)
 
 end_time = time.time() - start_time
 print(end_time) # should take somewhere around 80 seconds for one million heights
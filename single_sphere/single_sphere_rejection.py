@@ -19,7 +19,6 @@ s.DEBYE_LENGTH = 0.5*s.A
 
 sample_state = [0., 0., 1.1] # the position of a single sphere
 n_steps = 1000000 # the number of height positions to be generated
-f = open(outFile, 'w')
 
 start_time = time.time() 
 
@@ -27,12 +26,10 @@ start_time = time.time()
 partition_steps = 10000 # number of samples generated for Z
 partitionZ = s.generate_partition(partition_steps)
 
-for i in range(n_steps):
-	# get a position from rejection function
-	sample_state = s.single_sphere_rejection(partitionZ)
-	# send that position to the data file
-	f.write(str(sample_state[2]) + '\n')
-f.close()
+# get all the heights from the batch rejection function
+heights = s.single_sphere_rejection_batch(partitionZ, n_steps)
+# send all the heights to the data file at once
+np.savetxt(outFile, heights)
 
 end_time = time.time() - start_time
 print(end_time) # should take somewhere around 80 seconds for one million heights
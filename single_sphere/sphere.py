@@ -55,6 +55,24 @@ def single_sphere_rejection(partitionZ):
 			return new_location
 
 
+# this function performs the rejection algorithm for n heights at once.
+# heights are generated and accepted in batches of batch_size with array operations,
+# until n heights are accepted. It returns an array with the n heights
+def single_sphere_rejection_batch(partitionZ, n, batch_size=10000):
+	heights = np.empty(n)
+	count = 0
+	while count < n:
+		new_heights = np.random.uniform(A, max_height-A, batch_size)
+		acceptance_prob = (single_sphere_GB([0., 0., new_heights]))/partitionZ
+		if np.any(acceptance_prob > 1):
+			raise InvalidProbability('Acceptance Probability is greater than 1')
+		accepted = new_heights[np.random.uniform(0., 1., batch_size) < acceptance_prob]
+		num_accepted = min(accepted.size, n - count)
+		heights[count:count+num_accepted] = accepted[0:num_accepted]
+		count += num_accepted
+	return heights
+
+
 # by generating 10,000 samples for the distribution, this function generates a normalization
 # constant to use in single_sphere_rejection
 # the function uses the maximum sample for the partition function and multiplies by the 
@@ -0,0 +1,29 @@
+''' Test the rejection algorithm for a sphere next to a wall. '''
+
+import unittest
+import numpy as np
+import sphere as sp
+
+
+class TestSphere(unittest.TestCase):
+
+  def setUp(self):
+    np.random.seed(0)
+    self.partitionZ = sp.generate_partition(2000)
+
+  def test_rejection_batch_statistics(self):
+    ''' Test that single_sphere_rejection_batch samples the heights like single_sphere_rejection. '''
+    n = 20000
+    heights = np.array([sp.single_sphere_rejection(self.partitionZ)[2] for i in range(n)])
+    heights_batch = sp.single_sphere_rejection_batch(self.partitionZ, n)
+
+    # Compare the mean and the standard deviation within 4 standard errors
+    std_error = np.sqrt((np.var(heights) + np.var(heights_batch)) / n)
+    self.assertLess(abs(np.mean(heights) - np.mean(heights_batch)), 4 * std_error)
+    self.assertLess(abs(np.std(heights) - np.std(heights_batch)), 4 * std_error)
+    self.assertTrue(np.all(heights_batch >= sp.A))
+    self.assertTrue(np.all(heights_batch <= sp.max_height - sp.A))
+
+
+if __name__ == '__main__':
+  unittest.main()